@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmark for the playlist downloader.
+
+Starts a local HTTP server that imitates Aparat (playlist page, playlist
+JSON API, video pages, HLS manifests and media files) with configurable
+latency, per-connection bandwidth and failure injection, then runs the
+real pipeline from playlist enumeration through
+download_playlist_with_quality_selection. Per-stage latency, throughput
+and peak RSS are written to a JSON file so runs can be compared.
+
+Example:
+    python benchmark.py --videos 50 --latency-ms 40 --bandwidth-mbps 2 --output before.json
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import statistics
+import subprocess
+import tempfile
+import threading
+import contextlib
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+import main
+
+# Minimal MP4 file type box placed in front of the fake media payloads
+MP4_HEADER = b'\x00\x00\x00\x18ftypisom\x00\x00\x02\x00isomiso2'
+
+
+class FakeAparatHandler(BaseHTTPRequestHandler):
+    """Request handler serving synthetic Aparat content"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def send_body(self, status, body, content_type, extra_headers=None, truncate=False):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        if truncate:
+            # Injected fault: send half of the announced body and drop the connection
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        # Throttle each connection to the configured bandwidth
+        rate = self.config['bandwidth_bytes']
+        block_size = 64 * 1024
+        for offset in range(0, len(body), block_size):
+            block = body[offset:offset + block_size]
+            self.wfile.write(block)
+            if rate:
+                time.sleep(len(block) / rate)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        config = self.config
+        path, _, query = self.path.partition('?')
+        self.server.count_request(path)
+        if config['latency']:
+            time.sleep(config['latency'])
+
+        if path.startswith('/media/') or path.startswith('/hls/') or path.startswith('/v/'):
+            if self.server.rng_random() < config['failure_rate']:
+                self.send_body(503, b'', 'text/plain')
+                return
+
+        # Faults injected for this path by tests: 'error' (503), 'throttled' (429),
+        # 'forbidden' (403, e.g. an expired media URL), 'slow' or 'truncate'
+        self.fault = self.server.take_fault(path)
+        if self.fault == 'error':
+            self.send_body(503, b'', 'text/plain')
+            return
+        if self.fault == 'forbidden':
+            self.send_body(403, b'', 'text/plain')
+            return
+        if self.fault == 'throttled':
+            self.send_body(429, b'', 'text/plain', {'Retry-After': '30'})
+            return
+        if self.fault == 'slow':
+            time.sleep(0.3)
+
+        if path.startswith('/playlist/'):
+            self.send_body(200, self.server.playlist_page(), 'text/html; charset=utf-8')
+        elif path.startswith('/api/fa/v1/video/playlist/one/playlist_id/'):
+            if not config['api']:
+                self.send_body(404, b'{}', 'application/json')
+                return
+            page = int(query.split('page=')[1]) if 'page=' in query else 1
+            self.send_body(200, self.server.api_page(page), 'application/json')
+        elif path.startswith('/v/'):
+            self.send_body(200, self.server.video_page(path[3:].strip('/')), 'text/html; charset=utf-8')
+        elif path.startswith('/media/'):
+            self.serve_media(path[len('/media/'):])
+        elif path.startswith('/hls/'):
+            self.serve_hls(path[len('/hls/'):])
+        else:
+            self.send_body(404, b'Not found', 'text/plain')
+
+    def serve_media(self, name):
+        data = self.server.media_bytes(name)
+        range_header = self.headers.get('Range')
+        truncate = self.fault == 'truncate'
+        if range_header and range_header.startswith('bytes=') and self.config.get('range_support', True):
+            start, _, end = range_header[6:].partition('-')
+            start = int(start)
+            end = min(int(end) if end else len(data) - 1, len(data) - 1)
+            self.send_body(206, data[start:end + 1], 'video/mp4', {
+                'Content-Range': f"bytes {start}-{end}/{len(data)}",
+                'Accept-Ranges': 'bytes'
+            }, truncate=truncate)
+        elif self.config.get('range_support', True):
+            self.send_body(200, data, 'video/mp4', {'Accept-Ranges': 'bytes'}, truncate=truncate)
+        else:
+            self.send_body(200, data, 'video/mp4', truncate=truncate)
+
+    def serve_hls(self, name):
+        video_id, _, filename = name.partition('/')
+        segments = self.config['hls_segments']
+        if filename == 'index.m3u8':
+            lines = ['#EXTM3U', '#EXT-X-VERSION:7', '#EXT-X-TARGETDURATION:4', '#EXT-X-MAP:URI="init.mp4"']
+            for i in range(segments):
+                lines += ['#EXTINF:4.0,', f"seg{i}.m4s"]
+            lines.append('#EXT-X-ENDLIST')
+            self.send_body(200, ("\n".join(lines) + "\n").encode(), 'application/vnd.apple.mpegurl')
+        elif filename == 'init.mp4':
+            self.send_body(200, b'\x00\x00\x00\x18ftypisom', 'video/mp4')
+        elif filename.startswith('seg'):
+            data = self.server.media_bytes(f"{video_id}_hls.mp4")
+            index = int(filename[3:].split('.')[0])
+            size = len(data) // segments
+            self.send_body(200, data[index * size:(index + 1) * size], 'video/mp4',
+                           truncate=self.fault == 'truncate')
+        else:
+            self.send_body(404, b'Not found', 'text/plain')
+
+
+class FakeAparatServer(ThreadingHTTPServer):
+    """Local stand-in for aparat.com"""
+    daemon_threads = True
+
+    def __init__(self, config):
+        super().__init__(('127.0.0.1', 0), FakeAparatHandler)
+        self.config = config
+        self.video_ids = [f"bench{i:04d}" for i in range(config['videos'])]
+        self.random = random.Random(config['seed'])
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.request_paths = []
+        self.faults = {}        # path -> actions for its next requests (None = serve normally)
+        self.media_cache = {}
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def count_request(self, path):
+        with self.lock:
+            self.requests += 1
+            self.request_paths.append(path)
+
+    def take_fault(self, path):
+        """Next injected fault for path, or None"""
+        with self.lock:
+            actions = self.faults.get(path)
+            return actions.pop(0) if actions else None
+
+    def rng_random(self):
+        with self.lock:
+            return self.random.random()
+
+    def playlist_page(self):
+        items = "".join(
+            f'<div class="item"><a href="/v/{video_id}?playlist=1">'
+            f'<img src="/thumb/{video_id}.jpg"><span>Video {video_id}</span></a></div>'
+            for video_id in self.video_ids
+        )
+        return f"<html><head><title>Playlist</title></head><body>{items}</body></html>".encode()
+
+    def api_page(self, page):
+        per_page = self.config['api_page_size']
+        chunk = self.video_ids[(page - 1) * per_page:page * per_page]
+        has_next = page * per_page < len(self.video_ids)
+        body = {
+            'data': {
+                'type': 'playlist',
+                'links': {'next': f"?page={page + 1}" if has_next else None}
+            },
+            'included': [{'type': 'Video', 'id': video_id, 'attributes': {'uid': video_id}}
+                         for video_id in chunk]
+        }
+        return json.dumps(body).encode()
+
+    def video_page(self, video_id):
+        if self.config['hls']:
+            sources = f'<source src="/hls/{video_id}/index.m3u8" type="application/x-mpegURL">'
+        else:
+            sources = "".join(
+                f'<source src="/media/{video_id}_{height}.mp4" type="video/mp4" res="{height}" label="{height}p">'
+                for height in (720, 360)
+            )
+        return (f"<html><head><title>Benchmark video {video_id}</title></head>"
+                f"<body><h1>Benchmark video {video_id}</h1><video controls>{sources}</video></body></html>").encode()
+
+    def media_bytes(self, name):
+        """Deterministic pseudo-random payload for a media file"""
+        with self.lock:
+            if name not in self.media_cache:
+                size = int(self.config['video_size_mb'] * 1024 * 1024)
+                if name.endswith('_360.mp4'):
+                    size //= 2
+                seed = hashlib.sha256(name.encode()).digest()
+                # Starts with an MP4 ftyp box so container checks pass
+                data = MP4_HEADER + seed * (size // len(seed) + 1)
+                self.media_cache[name] = data[:size]
+            return self.media_cache[name]
+
+
+class StageTimer:
+    """Collects wall-clock durations of pipeline stages"""
+
+    def __init__(self):
+        self.samples = {}
+        self.first_start = {}
+        self.lock = threading.Lock()
+
+    def wrap(self, name, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            with self.lock:
+                self.first_start.setdefault(name, start)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.samples.setdefault(name, []).append(time.perf_counter() - start)
+        return timed
+
+    def summary(self):
+        result = {}
+        for name, values in self.samples.items():
+            ordered = sorted(values)
+            result[name] = {
+                'count': len(ordered),
+                'total_s': round(sum(ordered), 4),
+                'mean_s': round(sum(ordered) / len(ordered), 4),
+                'p50_s': round(ordered[len(ordered) // 2], 4),
+                'p95_s': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4),
+                'max_s': round(ordered[-1], 4),
+            }
+        return result
+
+
+def phase_quantile(phase, bounds, q):
+    """Upper bucket bound holding quantile q of a main.metrics histogram (None if above the last bucket)"""
+    target = phase['count'] * q
+    for bound, count in zip(bounds, phase['buckets']):
+        if count >= target:
+            return bound
+    return None
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and KB elsewhere
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def measure_startup(runs):
+    """Median wall time of starting the CLI (import only, and 'list --help')"""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    commands = {
+        'import_s': [sys.executable, '-c', 'import main'],
+        'list_help_s': [sys.executable, script, 'list', '--help'],
+    }
+    result = {}
+    for name, command in commands.items():
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run(command, cwd=os.path.dirname(script), stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, check=True)
+            samples.append(time.perf_counter() - start)
+        result[name] = round(statistics.median(samples), 4)
+    return result
+
+
+def configure_pipeline(server, args, timer):
+    """Point main.py at the fake server and instrument its stages"""
+    main.APARAT_DOMAIN = '127.0.0.1'
+    main.APARAT_BASE_URL = server.base_url
+    main.APARAT_API_BASE = f"{server.base_url}/api/fa/v1"
+    main.SELENIUM_AVAILABLE = False     # No browser in the benchmark
+    main.CACHE_ENABLED = False
+    main.SEGMENTED_DOWNLOADS = not args.no_segmented
+    main.HLS_PARALLEL = not args.no_parallel_hls
+    main.bandwidth_limiter.control_file = None
+    main.post_processor.configure(main.POSTPROCESS_STEPS + (args.postprocess or []))
+
+    # Page loads and link extraction happen inside the crawler and are
+    # reported from main.metrics; only the per-video stages are wrapped here
+    for name, func_name in (('format_probe', 'get_video_formats'),
+                            ('download', 'download_video_with_format')):
+        setattr(main, func_name, timer.wrap(name, getattr(main, func_name)))
+
+
+def run_benchmark(args):
+    config = {
+        'videos': args.videos,
+        'latency': args.latency_ms / 1000,
+        'bandwidth_bytes': args.bandwidth_mbps * 1024 * 1024 if args.bandwidth_mbps else None,
+        'failure_rate': args.failure_rate,
+        'video_size_mb': args.video_size_mb,
+        'hls': args.hls,
+        'hls_segments': args.hls_segments,
+        'api': not args.no_api,
+        'api_page_size': args.api_page_size,
+        'seed': args.seed,
+    }
+    server = FakeAparatServer(config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    timer = StageTimer()
+    configure_pipeline(server, args, timer)
+    policy = main.load_quality_policy(overrides={'max_height': args.max_height})
+    playlist_url = f"{server.base_url}/playlist/1"
+
+    output = sys.stdout if args.verbose else io.StringIO()
+    with tempfile.TemporaryDirectory(prefix='aparat_bench_') as download_path:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(output):
+            # Links stream from discovery into the download stage
+            stats = main.download_playlist_with_quality_selection(
+                main.iter_playlist_videos(playlist_url), download_path,
+                max_workers=args.workers, max_per_host=args.per_host,
+                policy=policy, playlist_url=playlist_url
+            ) or {}
+        wall = time.perf_counter() - start
+
+    server.shutdown()
+    downloaded = stats.get('downloaded', 0)
+    total_mb = stats.get('total_size_mb', 0)
+
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': {**vars(args)},
+        'results': {
+            'videos_found': stats.get('total', 0),
+            'downloaded': downloaded,
+            'failed': stats.get('failed', 0),
+            'skipped': stats.get('skipped', 0),
+            'wall_s': round(wall, 3),
+            'first_download_s': round(timer.first_start['download'] - start, 3) if 'download' in timer.first_start else None,
+            'videos_per_min': round(downloaded / wall * 60, 2) if wall else 0,
+            'mb_per_s': round(total_mb / wall, 3) if wall else 0,
+            'total_mb': round(total_mb, 2),
+            'extractor_calls': main.run_counters['extractor_calls'],
+            'postprocessed': main.post_processor.processed,
+            'postprocess_failed': main.post_processor.failed,
+            'progress_hook_calls': main.progress_dashboard.hook_calls,
+            'progress_hook_us': round(main.progress_dashboard.hook_overhead_us(), 2),
+            'server_requests': server.requests,
+            'peak_rss_mb': peak_rss_mb(),
+        },
+        'stages': timer.summary(),
+        'phases': main.metrics.snapshot(),
+        'phase_buckets': list(main.PHASE_BUCKETS),
+        'startup': measure_startup(args.startup_runs) if args.startup_runs else None,
+    }
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the downloader against a local fake Aparat server")
+    parser.add_argument('--videos', type=int, default=20, help="Videos in the playlist")
+    parser.add_argument('--video-size-mb', type=float, default=4, help="Size of the best format")
+    parser.add_argument('--latency-ms', type=float, default=30, help="Added latency per request")
+    parser.add_argument('--bandwidth-mbps', type=float, default=4, help="Per-connection bandwidth (0 = unlimited)")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Probability of a 503 on video/media requests")
+    parser.add_argument('--hls', action='store_true', help="Serve videos as HLS instead of progressive MP4")
+    parser.add_argument('--hls-segments', type=int, default=16, help="Fragments per HLS video")
+    parser.add_argument('--no-api', action='store_true', help="Disable the JSON API (forces page scraping)")
+    parser.add_argument('--api-page-size', type=int, default=50, help="Videos per API page")
+    parser.add_argument('--no-segmented', action='store_true', help="Disable the segmented downloader")
+    parser.add_argument('--no-parallel-hls', action='store_true', help="Disable parallel HLS fragments")
+    parser.add_argument('--postprocess', action='append', choices=list(main.POSTPROCESSORS),
+                        help="Extra post-processing step, repeatable (e.g. stub)")
+    parser.add_argument('--workers', type=int, default=main.MAX_WORKERS, help="Total concurrent downloads")
+    parser.add_argument('--per-host', type=int, default=main.MAX_PER_HOST, help="Concurrent downloads per media host")
+    parser.add_argument('--max-height', type=int, default=720, help="Quality policy max height")
+    parser.add_argument('--seed', type=int, default=1, help="Random seed for failure injection")
+    parser.add_argument('--startup-runs', type=int, default=5, help="CLI startup time samples (0 = skip)")
+    parser.add_argument('--output', default='bench_results.json', help="JSON results file")
+    parser.add_argument('--verbose', action='store_true', help="Show pipeline output")
+    return parser.parse_args()
+
+
+def main_benchmark():
+    args = parse_arguments()
+    report = run_benchmark(args)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    results = report['results']
+    print(f"Videos: {results['downloaded']}/{results['videos_found']} downloaded, {results['failed']} failed")
+    print(f"Wall time: {results['wall_s']:.2f} s | {results['videos_per_min']:.1f} videos/min | "
+          f"{results['mb_per_s']:.2f} MB/s | peak RSS {results['peak_rss_mb']} MB")
+    print(f"{'Stage':<22} {'Count':>6} {'Mean':>9} {'P95':>9} {'Total':>9}")
+    for name, stage in report['stages'].items():
+        print(f"{name:<22} {stage['count']:>6} {stage['mean_s']:>8.3f}s {stage['p95_s']:>8.3f}s {stage['total_s']:>8.2f}s")
+    for name in ('page_load', 'link_extraction'):
+        phase = report['phases'].get(name)
+        if phase and phase['count']:
+            p95 = phase_quantile(phase, report['phase_buckets'], 0.95)
+            print(f"{name:<22} {phase['count']:>6} {phase['sum'] / phase['count']:>8.3f}s "
+                  f"{'<' + format(p95, 'g') if p95 is not None else '>max':>8}s {phase['sum']:>8.2f}s")
+    if report['startup']:
+        print(f"Startup: import {report['startup']['import_s'] * 1000:.0f} ms, "
+              f"'list --help' {report['startup']['list_help_s'] * 1000:.0f} ms")
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -1,28 +1,617 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import yt_dlp
 import os
 import sys
 import re
+import html
 import time
 import json
-import requests
-from datetime import datetime
+import random
+import queue
+import hashlib
+import asyncio
+import argparse
+import atexit
+import shutil
+import socket
+import sqlite3
+import subprocess
+import threading
+import itertools
+import multiprocessing
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from urllib.parse import urljoin, urlparse, parse_qs
-from bs4 import BeautifulSoup
+
+# Heavy modules (yt_dlp, requests, bs4, selenium) are imported only on
+# the code paths that use them, so list/probe runs start quickly.
 
 # For loading JavaScript pages
-try:
-    from selenium import webdriver
-    from selenium.webdriver.common.by import By
-    from selenium.webdriver.support.ui import WebDriverWait
-    from selenium.webdriver.support import expected_conditions as EC
-    from selenium.webdriver.chrome.options import Options
-    from selenium.common.exceptions import TimeoutException, WebDriverException
-    SELENIUM_AVAILABLE = True
-except ImportError:
-    SELENIUM_AVAILABLE = False
+SELENIUM_AVAILABLE = importlib.util.find_spec('selenium') is not None
+
+# Download scheduler settings
+MAX_WORKERS = 4         # Total concurrent downloads
+MAX_PER_HOST = MAX_WORKERS     # Concurrent transfers per media host (lower to spare one CDN)
+PREFETCH_AHEAD = 3      # Videos whose formats are probed ahead of the prompt
+DOWNLOAD_QUEUE_SIZE = 16    # Selected videos waiting for a free download worker
+REQUEUE_ROUNDS = 1          # Extra passes over failed videos at the end of a batch
+
+# Retry and circuit breaker settings
+RETRY_MAX_ATTEMPTS = 5          # Attempts per request for retryable errors
+RETRY_BASE_DELAY = 1.0          # Backoff is random in [0, base * 2^attempt] seconds
+RETRY_MAX_DELAY = 60.0
+CIRCUIT_FAILURE_THRESHOLD = 5   # Consecutive failures that open a host's circuit
+CIRCUIT_OPEN_SECONDS = 30       # Pause for a host with an open circuit
+
+# Browser pool settings
+BROWSER_POOL_SIZE = 2   # Max warm browser sessions
+BROWSER_MAX_PAGES = 50  # Recycle a browser after this many pages
+
+# Page loading settings
+PAGE_READY_TIMEOUT = 15     # Max seconds to wait for a page to become ready
+SCROLL_IDLE_TIMEOUT = 4     # Stop scrolling after this long without new items
+SCROLL_MAX_SECONDS = 180    # Upper bound for infinite scrolling
+
+# Aparat site settings (overridable, e.g. for the local benchmark server)
+APARAT_DOMAIN = "aparat.com"
+APARAT_BASE_URL = "https://www.aparat.com"
+APARAT_API_BASE = "https://www.aparat.com/api/fa/v1"
+API_MAX_PAGES = 500         # Safety limit for playlist pagination
+HTTP_POOL_SIZE = 16         # Pooled connections per host
+
+# Crawler settings (many playlists or channels at once)
+CRAWL_CONCURRENCY = 8       # Page/API requests in flight across all hosts
+CRAWL_PER_HOST = 4          # Page/API requests in flight per host
+CRAWL_HOST_DELAY = 0.05     # Minimum seconds between requests to one host
+CRAWL_QUEUE_SIZE = 1000     # Discovered links buffered ahead of the download stage
+
+# Size discovery for formats without a filesize
+SIZE_PROBE_WORKERS = 8      # Concurrent HEAD/Range requests
+SIZE_PROBE_TIMEOUT = 10     # Seconds per size request
+
+# Metadata cache settings
+CACHE_ENABLED = True        # Set to False to bypass the cache
+CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'aparat-downloader', 'metadata.sqlite3')
+CACHE_TTL_HOURS = 24        # Entries older than this are probed again
+CACHE_MAX_MB = 50           # Least recently used entries are evicted above this size
+
+# Job journal settings
+JOURNAL_FILE = 'job_journal.jsonl'
+JOURNAL_PROGRESS_INTERVAL = 5   # Seconds between byte-progress records per video
+
+# Segmented download settings (progressive formats only)
+SEGMENTED_DOWNLOADS = True
+SEGMENT_CONNECTIONS = 4     # Parallel HTTP connections per video
+SEGMENT_SIZE_MB = 4         # Size of one Range request
+SEGMENT_RETRIES = 3         # Retries per segment
+
+# Integrity checks
+DIGEST_CHUNK_MB = 4             # Files are hashed in chunks of this size as bytes arrive
+MANIFEST_FILE = 'manifest.jsonl'
+
+# HLS download settings
+HLS_PARALLEL = True
+HLS_FRAGMENT_WORKERS = 6        # Fragments fetched at the same time
+HLS_FRAGMENT_RETRIES = 5        # Retries per fragment
+HLS_MAX_BUFFER_MB = 64          # Byte budget for fragments fetched ahead of the writer
+
+# Distributed work queue (coordinator/worker mode)
+QUEUE_FILE = 'work_queue.sqlite3'   # Put on storage shared by all workers
+QUEUE_LEASE_SECONDS = 120           # Jobs of workers silent this long are handed out again
+QUEUE_HEARTBEAT_SECONDS = 30        # How often workers renew their leases
+QUEUE_MAX_ATTEMPTS = 3              # Attempts per video before it is marked failed
+QUEUE_POLL_SECONDS = 5              # Idle wait between queue checks
+
+# Post-processing settings (run in a process pool, apart from the downloads)
+POSTPROCESS_STEPS = ['remux_mp4']   # Always run; more can be added with --postprocess
+POSTPROCESS_WORKERS = os.cpu_count() or 1
+POSTPROCESS_QUEUE_SIZE = 32         # Finished files waiting for a free process
+POSTPROCESS_STUB_SECONDS = 0.2      # CPU time used by the 'stub' test step
+
+# Content-addressed store for batch downloads of overlapping playlists
+STORE_DIR = '.store'                # Inside the download folder
+
+# Bandwidth limits in MB/s (None = unlimited)
+BANDWIDTH_LIMIT_MBPS = None         # Shared by all downloads
+PER_VIDEO_LIMIT_MBPS = None         # Per single video
+BANDWIDTH_SCHEDULE = []             # e.g. [{"start": "01:00", "end": "07:00", "limit_mbps": None}]
+BANDWIDTH_CONTROL_FILE = 'bandwidth.json'   # Edit while running to change limits
+
+# Progress display settings
+PROGRESS_REFRESH_SECONDS = 0.5      # Redraw interval on a terminal
+PROGRESS_LOG_SECONDS = 10           # Interval of plain progress lines when stdout is not a terminal
+PROGRESS_MAX_ROWS = 8               # Per-video bars shown at once
+
+# Metrics export (None = disabled)
+METRICS_EVENTS_FILE = None          # JSON-lines phase events
+METRICS_PROM_FILE = None            # Prometheus textfile (node_exporter textfile collector)
+METRICS_PROM_INTERVAL = 10          # Seconds between textfile rewrites during a run
+PHASE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+
+# Lock guarding shared stats and log files
+stats_lock = threading.Lock()
+
+# Per-run counters (shown in the summary)
+run_counters = {
+    'extractor_calls': 0,
+    'cache_hits': 0,
+    'cache_misses': 0
+}
+
+def update_stats(stats, **changes):
+    """Add values to numeric stats fields (thread-safe)"""
+    with stats_lock:
+        for key, value in changes.items():
+            stats[key] += value
+
+def append_to_file(filepath, text):
+    """Append text to a log file in one write (thread-safe)"""
+    with stats_lock:
+        with open(filepath, 'a', encoding='utf-8') as f:
+            f.write(text)
+
+class AdaptivePacer:
+    """
+    Adaptive delay between requests to one host.
+    The delay halves after each success and doubles after each failure.
+    """
+    def __init__(self, min_delay=0.0, max_delay=30.0, initial_delay=0.5):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay = initial_delay
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until this caller's request slot comes up"""
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.delay
+        if slot > now:
+            time.sleep(slot - now)
+
+    def record(self, success):
+        """Adjust the delay based on the last request result"""
+        with self.lock:
+            if success:
+                self.delay = max(self.min_delay, self.delay / 2)
+            else:
+                self.delay = min(self.max_delay, max(self.delay * 2, 1.0))
+
+class TransferError(IOError):
+    """Transfer cut short (e.g. a segment with missing bytes); retried like a network error"""
+
+def classify_error(error):
+    """
+    Classify a request/download error: 'throttled' (429), 'server' (5xx),
+    'timeout', 'network' (connection or transfer failure) or 'permanent'
+    (other 4xx, unsupported pages, missing formats and any unknown error)
+    """
+    import requests
+    
+    status = getattr(getattr(error, 'response', None), 'status_code', None) or getattr(error, 'status', None)
+    if not isinstance(status, int):
+        # yt-dlp only carries the status in the message
+        match = re.search(r'HTTP Error (\d{3})\b', str(error))
+        status = int(match.group(1)) if match else None
+    if status == 429:
+        return 'throttled'
+    if status == 408:
+        return 'timeout'
+    if status is not None and status >= 500:
+        return 'server'
+    if status is not None and status >= 400:
+        return 'permanent'
+    
+    # yt-dlp wraps the original error (DownloadError.exc_info, ExtractorError.cause)
+    cause = getattr(error, 'cause', None) or (getattr(error, 'exc_info', None) or (None, None))[1]
+    if isinstance(cause, BaseException) and cause is not error:
+        return classify_error(cause)
+    
+    if isinstance(error, (requests.exceptions.Timeout, TimeoutError)):
+        return 'timeout'
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                          ConnectionError, TransferError, IntegrityError)):
+        return 'network'
+    ytdlp_errors = sys.modules.get('yt_dlp.networking.exceptions')
+    if ytdlp_errors and isinstance(error, ytdlp_errors.TransportError):
+        return 'network'
+    return 'permanent'
+
+def get_retry_after(error):
+    """Seconds from the Retry-After header of a failed response, or None"""
+    response = getattr(error, 'response', None)
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        # yt-dlp wraps the HTTP error that carries the response
+        cause = getattr(error, 'cause', None) or (getattr(error, 'exc_info', None) or (None, None))[1]
+        if isinstance(cause, BaseException) and cause is not error:
+            return get_retry_after(cause)
+        return None
+    if value.strip().isdigit():
+        return int(value)
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+class RetryController:
+    """
+    Retries by error class with jittered exponential backoff and a
+    per-host circuit breaker. A 429, a Retry-After header or a run of
+    failures opens the host's circuit, and every request or scheduled
+    download for that host waits until it closes. Permanent errors
+    (4xx, unsupported pages, unknown exceptions) are not retried and do
+    not count toward the circuit.
+    """
+    def __init__(self, max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failures = {}          # host -> consecutive failures
+        self.open_until = {}        # host -> monotonic time the circuit closes
+        self.random = random.Random()
+        self.lock = threading.Lock()
+
+    def backoff(self, attempt):
+        """Full-jitter exponential delay before retry number attempt (0-based)"""
+        return self.random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def wait(self, url):
+        """Block while the circuit of url's host is open"""
+        host = urlparse(url).netloc
+        while True:
+            with self.lock:
+                remaining = self.open_until.get(host, 0) - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def record_success(self, url):
+        with self.lock:
+            self.failures[urlparse(url).netloc] = 0
+
+    def record_failure(self, url, kind, retry_after=None):
+        """Count a failed request and open the host's circuit if needed"""
+        if kind == 'permanent':
+            return
+        host = urlparse(url).netloc
+        with self.lock:
+            count = self.failures.get(host, 0) + 1
+            self.failures[host] = count
+            pause = retry_after or 0
+            if kind == 'throttled':
+                pause = max(pause, self.backoff(count))
+            if count >= CIRCUIT_FAILURE_THRESHOLD:
+                pause = max(pause, CIRCUIT_OPEN_SECONDS)
+            if not pause:
+                return
+            now = time.monotonic()
+            newly_open = self.open_until.get(host, 0) <= now
+            self.open_until[host] = max(self.open_until.get(host, 0), now + pause)
+        if newly_open:
+            print(f"🚧 {host}: {kind} errors, pausing requests for {pause:.0f}s")
+
+    def call(self, func, url, *args, max_attempts=None):
+        """Run func(url, *args), retrying retryable errors with backoff"""
+        attempts = max_attempts or self.max_attempts
+        for attempt in range(attempts):
+            self.wait(url)
+            try:
+                result = func(url, *args)
+            except Exception as e:
+                kind = classify_error(e)
+                self.record_failure(url, kind, get_retry_after(e))
+                e.circuit_counted = True    # Callers must not count it again
+                if kind == 'permanent' or attempt == attempts - 1:
+                    raise
+                time.sleep(self.backoff(attempt))
+                continue
+            self.record_success(url)
+            return result
+
+retry_controller = RetryController()
+
+class DownloadScheduler:
+    """
+    Bounded worker pool with a per-host concurrency cap and adaptive pacing.
+    The cap applies to the host the transfer hits (media_url), not the
+    page host shared by every video. submit() blocks while max_queued
+    jobs are already waiting, so a long playlist never piles up in memory
+    ahead of the workers. Jobs for a host whose circuit is open wait
+    until it closes.
+    """
+    def __init__(self, max_workers=MAX_WORKERS, max_per_host=MAX_PER_HOST, max_queued=DOWNLOAD_QUEUE_SIZE):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.max_per_host = max_per_host
+        self.host_slots = {}
+        self.pacers = {}
+        self.queue_slots = threading.Semaphore(max_workers + max_queued)
+        self.failures = 0
+        self.failed_jobs = []
+        self.running = 0
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+
+    def _host_state(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.Semaphore(self.max_per_host)
+                self.pacers[host] = AdaptivePacer()
+            return self.host_slots[host], self.pacers[host]
+
+    def _run(self, func, url, media_url, *args):
+        slots, pacer = self._host_state(media_url or url)
+        with slots:
+            retry_controller.wait(media_url or url)
+            pacer.wait()
+            success = func(url, *args)
+            pacer.record(bool(success))
+            return success
+
+    def _finished(self, future, job):
+        self.queue_slots.release()
+        try:
+            success = future.result()
+        except Exception as e:
+            print(f"❌ Worker error: {e}")
+            success = False
+        with self.idle:
+            if not success:
+                self.failures += 1
+            if success is False:
+                self.failed_jobs.append(job)
+            self.running -= 1
+            self.idle.notify_all()
+
+    def submit(self, func, url, *args, media_url=None):
+        """
+        Queue func(url, *args). func returns True on success, False on a
+        failure worth retrying later and None on a permanent failure.
+        media_url is the URL the transfer fetches, used for the host cap.
+        """
+        self.queue_slots.acquire()
+        with self.lock:
+            self.running += 1
+        job = (func, url, args, media_url)
+        future = self.executor.submit(self._run, func, url, media_url, *args)
+        future.add_done_callback(lambda done: self._finished(done, job))
+        return future
+
+    def requeue_failed(self):
+        """Once all jobs are done, queue the retryable failures again; returns their number"""
+        with self.idle:
+            while self.running:
+                self.idle.wait()
+            jobs, self.failed_jobs = self.failed_jobs, []
+            self.failures -= len(jobs)
+        for func, url, args, media_url in jobs:
+            self.submit(func, url, *args, media_url=media_url)
+        return len(jobs)
+
+    def wait_all(self):
+        """Wait for all queued jobs, shut down the pool and return the number of failures"""
+        self.executor.shutdown(wait=True)
+        return self.failures
+
+def mbps_to_bytes(limit_mbps):
+    """Convert MB/s to bytes/s (None stays unlimited)"""
+    return None if limit_mbps is None else max(1.0, float(limit_mbps) * 1024 * 1024)
+
+class TokenBucket:
+    """
+    Token bucket rate limiter (thread-safe).
+    Callers take tokens up front and sleep off any deficit.
+    """
+    def __init__(self, rate=None):
+        self.rate = rate            # bytes/s, None = unlimited
+        self.tokens = rate or 0.0
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self.lock:
+            if rate != self.rate:
+                self.rate = rate
+                self.tokens = min(self.tokens, rate) if rate else 0.0
+
+    def consume(self, num_bytes):
+        """Block until num_bytes may pass at the current rate"""
+        with self.lock:
+            if self.rate is None:
+                return
+            now = time.monotonic()
+            # Refill, allowing at most one second of burst
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= num_bytes
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+def parse_clock(value):
+    """'HH:MM' to minutes after midnight"""
+    hours, minutes = value.split(':')
+    return int(hours) * 60 + int(minutes)
+
+class BandwidthLimiter:
+    """
+    Process-wide bandwidth governor shared by every download path.
+    Applies the global limit (or the scheduled limit for the current time
+    of day) and an optional per-video limit. Limits can be changed at
+    runtime with set_limits() or by editing BANDWIDTH_CONTROL_FILE.
+    """
+    def __init__(self, limit_mbps=BANDWIDTH_LIMIT_MBPS, per_video_mbps=PER_VIDEO_LIMIT_MBPS,
+                 schedule=None, control_file=BANDWIDTH_CONTROL_FILE):
+        self.bucket = TokenBucket()
+        self.control_file = control_file
+        self.control_mtime = None
+        self.next_check = 0.0
+        self.lock = threading.Lock()
+        self.set_limits(limit_mbps, per_video_mbps, schedule if schedule is not None else BANDWIDTH_SCHEDULE)
+
+    def set_limits(self, limit_mbps=None, per_video_mbps=None, schedule=None):
+        """Change limits for all running and future downloads"""
+        for entry in schedule or []:
+            parse_clock(entry['start'])
+            parse_clock(entry['end'])
+        with self.lock:
+            self.limit_mbps = limit_mbps
+            self.per_video_mbps = per_video_mbps
+            self.schedule = list(schedule or [])
+        self._apply_rate()
+
+    def current_limit_mbps(self, now=None):
+        """Global limit in effect at the given (or current) time"""
+        now = now or datetime.now()
+        minute = now.hour * 60 + now.minute
+        with self.lock:
+            for entry in self.schedule:
+                start, end = parse_clock(entry['start']), parse_clock(entry['end'])
+                inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+                if inside:
+                    return entry.get('limit_mbps')
+            return self.limit_mbps
+
+    def _apply_rate(self):
+        self.bucket.set_rate(mbps_to_bytes(self.current_limit_mbps()))
+
+    def _check_control_file(self):
+        """Reload limits when the control file changes (checked every 2 seconds)"""
+        now = time.monotonic()
+        with self.lock:
+            if now < self.next_check:
+                return
+            self.next_check = now + 2
+        
+        self._apply_rate()      # Schedule windows may have changed
+        if not self.control_file or not os.path.exists(self.control_file):
+            return
+        try:
+            mtime = os.path.getmtime(self.control_file)
+            if mtime == self.control_mtime:
+                return
+            self.control_mtime = mtime
+            with open(self.control_file, 'r', encoding='utf-8') as f:
+                settings = json.load(f)
+            self.set_limits(settings.get('limit_mbps'), settings.get('per_video_limit_mbps'),
+                            settings.get('schedule'))
+            print(f"\n⚙️ Bandwidth limits reloaded from {self.control_file}")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"\n⚠️ Invalid bandwidth control file: {e}")
+
+    def new_video_bucket(self):
+        """Token bucket for a single video's per-video limit"""
+        return TokenBucket(mbps_to_bytes(self.per_video_mbps))
+
+    def throttle(self, num_bytes, video_bucket=None):
+        """Block the calling download until num_bytes may pass"""
+        if num_bytes <= 0:
+            return
+        self._check_control_file()
+        if video_bucket is not None:
+            video_bucket.set_rate(mbps_to_bytes(self.per_video_mbps))
+            video_bucket.consume(num_bytes)
+        self.bucket.consume(num_bytes)
+
+bandwidth_limiter = BandwidthLimiter()
+
+class Metrics:
+    """
+    Per-phase timing histograms, exported as JSON-lines events and as a
+    Prometheus textfile. Phases: page_load, link_extraction, format_probe,
+    size_probe, probe_wait, selection_wait, transfer, post_processing.
+    """
+    def __init__(self, events_file=METRICS_EVENTS_FILE, prom_file=METRICS_PROM_FILE):
+        self.lock = threading.Lock()
+        self.histograms = {}        # phase -> {'buckets': [...], 'sum': s, 'count': n}
+        self.events = None
+        self.prom_file = None
+        self.last_prom_write = 0.0
+        self.configure(events_file, prom_file)
+
+    def configure(self, events_file=None, prom_file=None):
+        """Set export destinations (None disables that export)"""
+        with self.lock:
+            if self.events:
+                self.events.close()
+            self.events = open(events_file, 'a', encoding='utf-8') if events_file else None
+            self.prom_file = prom_file
+
+    def observe(self, phase, seconds, **labels):
+        """Record one phase duration"""
+        with self.lock:
+            histogram = self.histograms.setdefault(
+                phase, {'buckets': [0] * len(PHASE_BUCKETS), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(PHASE_BUCKETS):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+            
+            if self.events:
+                event = {'time': time.time(), 'phase': phase, 'duration_s': round(seconds, 6), **labels}
+                self.events.write(json.dumps(event, ensure_ascii=False) + "\n")
+                self.events.flush()
+            
+            due = self.prom_file and time.monotonic() - self.last_prom_write >= METRICS_PROM_INTERVAL
+        if due:
+            self.write_prometheus()
+
+    @contextmanager
+    def phase(self, name, **labels):
+        """Time the enclosed block as one phase observation"""
+        start = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        """Copy of all histograms"""
+        with self.lock:
+            return {phase: {'buckets': list(h['buckets']), 'sum': h['sum'], 'count': h['count']}
+                    for phase, h in self.histograms.items()}
+
+    def write_prometheus(self):
+        """Write all metrics to the Prometheus textfile (atomically)"""
+        if not self.prom_file:
+            return
+        lines = [
+            "# HELP aparat_phase_duration_seconds Time spent in each downloader phase.",
+            "# TYPE aparat_phase_duration_seconds histogram",
+        ]
+        for phase, histogram in sorted(self.snapshot().items()):
+            for bound, count in zip(PHASE_BUCKETS, histogram['buckets']):
+                lines.append(f'aparat_phase_duration_seconds_bucket{{phase="{phase}",le="{bound}"}} {count}')
+            lines.append(f'aparat_phase_duration_seconds_bucket{{phase="{phase}",le="+Inf"}} {histogram["count"]}')
+            lines.append(f'aparat_phase_duration_seconds_sum{{phase="{phase}"}} {histogram["sum"]:.6f}')
+            lines.append(f'aparat_phase_duration_seconds_count{{phase="{phase}"}} {histogram["count"]}')
+        with stats_lock:
+            counters = dict(run_counters)
+        for name, value in sorted(counters.items()):
+            lines.append(f"# TYPE aparat_{name}_total counter")
+            lines.append(f"aparat_{name}_total {value}")
+        
+        tmp_path = self.prom_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.prom_file)
+        with self.lock:
+            self.last_prom_write = time.monotonic()
+
+    def close(self):
+        self.write_prometheus()
+        self.configure(None, self.prom_file)
+
+metrics = Metrics()
+atexit.register(metrics.close)
 
 def clear_screen():
     """Clear terminal screen"""
@@ -47,8 +636,9 @@ def setup_selenium_driver():
         return None
     
     try:
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
         from selenium.webdriver.chrome.service import Service
-        from webdriver_manager.chrome import ChromeDriverManager
         
         # Chrome settings
         chrome_options = Options()
@@ -59,8 +649,8 @@ def setup_selenium_driver():
         chrome_options.add_argument('--window-size=1920,1080')
         chrome_options.add_argument('--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36')
         
-        # Auto-install ChromeDriver
-        service = Service(ChromeDriverManager().install())
+        # Auto-install ChromeDriver (resolved once per process)
+        service = Service(get_chromedriver_path())
         driver = webdriver.Chrome(service=service, options=chrome_options)
         
         return driver
@@ -68,6 +658,95 @@ def setup_selenium_driver():
         print(f"❌ Error setting up WebDriver: {e}")
         return None
 
+_chromedriver_path = None
+_chromedriver_lock = threading.Lock()
+
+def get_chromedriver_path():
+    """Resolve ChromeDriver path once and reuse it"""
+    global _chromedriver_path
+    with _chromedriver_lock:
+        if _chromedriver_path is None:
+            from webdriver_manager.chrome import ChromeDriverManager
+            _chromedriver_path = ChromeDriverManager().install()
+        return _chromedriver_path
+
+class BrowserPool:
+    """
+    Pool of warm Selenium browser sessions.
+    Browsers are health-checked before reuse and recycled after max_pages.
+    """
+    def __init__(self, max_size=BROWSER_POOL_SIZE, max_pages=BROWSER_MAX_PAGES):
+        self.max_size = max_size
+        self.max_pages = max_pages
+        self.idle = []              # [driver, pages_used]
+        self.created = 0
+        self.lock = threading.Lock()
+        self.available = threading.Semaphore(max_size)
+
+    @staticmethod
+    def _is_healthy(driver):
+        try:
+            return driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    @staticmethod
+    def _quit(driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def _checkout(self):
+        """Return an idle healthy browser entry or a new one"""
+        while True:
+            with self.lock:
+                entry = self.idle.pop() if self.idle else None
+            if entry is None:
+                break
+            if self._is_healthy(entry[0]):
+                return entry
+            self._quit(entry[0])
+        
+        driver = setup_selenium_driver()
+        if driver is None:
+            return None
+        with self.lock:
+            self.created += 1
+        return [driver, 0]
+
+    @contextmanager
+    def driver(self):
+        """Borrow a browser; yields None if Selenium is unavailable"""
+        self.available.acquire()
+        entry = None
+        broken = False
+        try:
+            entry = self._checkout()
+            yield entry[0] if entry else None
+        except Exception:
+            broken = True
+            raise
+        finally:
+            if entry:
+                entry[1] += 1
+                if broken or entry[1] >= self.max_pages:
+                    self._quit(entry[0])
+                else:
+                    with self.lock:
+                        self.idle.append(entry)
+            self.available.release()
+
+    def close(self):
+        """Quit all idle browsers"""
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for driver, _ in idle:
+            self._quit(driver)
+
+browser_pool = BrowserPool()
+atexit.register(browser_pool.close)
+
 def extract_video_links_from_page(playlist_url):
     """
     Load playlist page and extract video links
@@ -77,94 +756,110 @@ def extract_video_links_from_page(playlist_url):
     video_links = []
     
     # Method 1: Use Selenium for full page load
-    driver = setup_selenium_driver()
-    
-    if driver:
-        print("🌐 Loading page with virtual browser...")
-        try:
-            driver.get(playlist_url)
-            
-            # Wait for page to load
-            time.sleep(5)
-            
-            # Scroll to load all content
-            last_height = driver.execute_script("return document.body.scrollHeight")
-            for i in range(3):  # Scroll 3 times
-                driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-                time.sleep(2)
-                new_height = driver.execute_script("return document.body.scrollHeight")
-                if new_height == last_height:
-                    break
-                last_height = new_height
-            
-            # Get complete HTML code
-            page_html = driver.page_source
-            
-            # Close browser
-            driver.quit()
-            
-            # Parse HTML with BeautifulSoup
-            return extract_links_from_html(page_html, playlist_url)
-            
-        except Exception as e:
-            print(f"❌ Error loading page with Selenium: {e}")
+    try:
+        with browser_pool.driver() as driver:
             if driver:
-                driver.quit()
+                print("🌐 Loading page with virtual browser...")
+                with metrics.phase('page_load', source='browser'):
+                    driver.get(playlist_url)
+                    
+                    # Wait until the first video links are rendered
+                    wait_for_page_ready(driver, lambda d: d.execute_script(COUNT_VIDEO_ELEMENTS_JS) > 0)
+                
+                # Scroll until no new items appear, harvesting links as we go
+                with metrics.phase('link_extraction', source='browser'):
+                    video_links = scroll_and_harvest_links(driver)
+                
+                print_found_links(video_links)
+                return video_links
+            
+    except Exception as e:
+        print(f"❌ Error loading page with Selenium: {e}")
     
     # Method 2: Use requests and BeautifulSoup (for simpler pages)
     print("🔄 Using alternative method (requests)...")
     return extract_with_requests(playlist_url)
 
-def extract_links_from_html(html_content, base_url):
+# JavaScript snippets for harvesting links from the live DOM
+VIDEO_ELEMENTS_SELECTOR = 'a[href*="/v/"], iframe[src*="/v/"]'
+COUNT_VIDEO_ELEMENTS_JS = f"return document.querySelectorAll('{VIDEO_ELEMENTS_SELECTOR}').length;"
+HARVEST_VIDEO_LINKS_JS = (
+    f"return Array.from(document.querySelectorAll('{VIDEO_ELEMENTS_SELECTOR}'))"
+    ".map(e => e.href || e.src);"
+)
+INLINE_SCRIPTS_JS = "return Array.from(document.scripts).map(s => s.text).join('\\n');"
+
+def wait_for_page_ready(driver, condition=None, timeout=PAGE_READY_TIMEOUT):
     """
-    Extract video links from HTML
+    Wait until the document has loaded and the optional condition holds.
+    Returns False on timeout (the caller continues with what is loaded).
     """
-    print("🔎 Searching for video links in HTML...")
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.common.exceptions import TimeoutException
     
-    soup = BeautifulSoup(html_content, 'html.parser')
-    video_links = []
+    def is_ready(d):
+        if d.execute_script("return document.readyState") != 'complete':
+            return False
+        return condition(d) if condition else True
     
-    # Search in all <a> tags
-    for link in soup.find_all('a', href=True):
-        href = link['href']
-        
-        # Convert relative links to absolute
-        if href.startswith('/'):
-            href = urljoin(base_url, href)
-        
-        # Check if link is a video
-        if '/v/' in href and 'aparat.com' in href:
-            # Clean the link
-            href = href.split('?')[0]  # Remove query parameters
-            video_links.append(href)
-    
-    # Search in iframe src attributes
-    for iframe in soup.find_all('iframe', src=True):
-        src = iframe['src']
-        if 'aparat.com' in src and '/v/' in src:
-            if src.startswith('/'):
-                src = urljoin(base_url, src)
-            src = src.split('?')[0]
-            video_links.append(src)
-    
-    # Search in scripts
-    for script in soup.find_all('script'):
-        if script.string:
-            script_text = script.string
-            # Find video IDs
-            video_ids = re.findall(r'/v/([a-zA-Z0-9_\-]+)', script_text)
-            for video_id in video_ids:
-                video_link = f"https://www.aparat.com/v/{video_id}"
-                video_links.append(video_link)
-    
-    # Remove duplicate links
-    unique_links = []
-    seen = set()
-    for link in video_links:
-        if link not in seen:
-            unique_links.append(link)
-            seen.add(link)
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=0.25).until(is_ready)
+        return True
+    except TimeoutException:
+        print(f"⚠️ Page not ready after {timeout} seconds, continuing anyway")
+        return False
+
+def harvest_video_links(driver, found):
+    """Add video links currently in the DOM to the ordered dict 'found'"""
+    for href in driver.execute_script(HARVEST_VIDEO_LINKS_JS) or []:
+        if href and '/v/' in href and APARAT_DOMAIN in href:
+            found.setdefault(href.split('?')[0], None)
+
+def scroll_and_harvest_links(driver):
+    """
+    Scroll until the number of items stops growing (bounded by
+    SCROLL_MAX_SECONDS), collecting video links after every scroll so
+    items removed by virtualized lists are not lost.
+    """
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.common.exceptions import TimeoutException
+    
+    found = {}
+    harvest_video_links(driver, found)
     
+    start_time = time.monotonic()
+    while time.monotonic() - start_time < SCROLL_MAX_SECONDS:
+        links_before = len(found)
+        items_before = driver.execute_script(COUNT_VIDEO_ELEMENTS_JS)
+        height_before = driver.execute_script("return document.body.scrollHeight")
+        
+        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+        
+        # Wait for lazy-loaded items or page growth
+        grew = True
+        try:
+            WebDriverWait(driver, SCROLL_IDLE_TIMEOUT, poll_frequency=0.25).until(
+                lambda d: d.execute_script(COUNT_VIDEO_ELEMENTS_JS) != items_before
+                or d.execute_script("return document.body.scrollHeight") > height_before
+            )
+        except TimeoutException:
+            grew = False
+        
+        harvest_video_links(driver, found)
+        if not grew and len(found) == links_before:
+            break
+    else:
+        print(f"⚠️ Stopped scrolling after {SCROLL_MAX_SECONDS} seconds")
+    
+    # Video IDs referenced in inline scripts
+    script_text = driver.execute_script(INLINE_SCRIPTS_JS) or ''
+    for video_id in re.findall(r'/v/([a-zA-Z0-9_\-]+)', script_text):
+        found.setdefault(f"{APARAT_BASE_URL}/v/{video_id}", None)
+    
+    return list(found)
+
+def print_found_links(unique_links):
+    """Print number of links found and a few samples"""
     print(f"✅ Links found: {len(unique_links)}")
     
     # Display sample links
@@ -174,26 +869,162 @@ def extract_links_from_html(html_content, base_url):
             print(f"   {i}. {link}")
         if len(unique_links) > 5:
             print(f"   ... and {len(unique_links) - 5} more links")
+
+# One-pass tokenizer for link extraction, following html.parser: comments,
+# declarations and processing instructions (whose content is not markup),
+# then script/style/<a>/<iframe> start tags
+TAG_ATTRS_PATTERN = r'((?:[^>"\']|"[^"]*"|\'[^\']*\')*)'
+LINK_TOKEN_RE = re.compile(
+    # A comment ends at the first '-->'; if there is none, parsing resumes after the next '>'
+    r'<!--.*?--\s*>|<!--[^>]*>'
+    r'|<!\[(?:cdata|temp|ignore|include|rcdata)(?![-_.a-z0-9]).*?\]\s*\]\s*>'
+    r'|<!\[(?:if|else|endif)(?![-_.a-z0-9]).*?\]\s*>'
+    r'|<!(?!--)[^>]*>|<\?[^>]*>|</(?![a-z])[^>]*>'
+    r'|<(script|style|a|iframe)(?=[\s/>])' + TAG_ATTRS_PATTERN + r'>',
+    re.S | re.I
+)
+RAW_TEXT_END_RE = {name: re.compile(rf'</\s*{name}\s*>', re.I) for name in ('script', 'style')}
+# Attribute syntax as html.parser reads it, to tell '<script/>' from '<script src=a/>'
+START_TAG_GAP_RE = re.compile(r'(?:\s|/(?!\Z))*')
+START_TAG_ATTR_RE = re.compile(
+    r'(?<=[\'"\s/])[^\s/>][^\s/=>]*(?:\s*=+\s*(?:\'[^\']*\'|"[^"]*"|(?![\'"])[^>\s]*))?(?:\s|/(?!\Z))*'
+)
+ATTR_RE = re.compile(r'([^\s/>"\'=][^\s/>"\'=]*)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+)))?')
+VIDEO_ID_RE = re.compile(r'/v/([a-zA-Z0-9_\-]+)')
+
+def parse_tag_attrs(attrs_text):
+    """Parse attributes of a start tag into a dict (last duplicate wins)"""
+    attrs = {}
+    for name, double_quoted, single_quoted, unquoted in ATTR_RE.findall(attrs_text):
+        value = double_quoted or single_quoted or unquoted
+        attrs[name.lower()] = html.unescape(value) if '&' in value else value
+    return attrs
+
+def opens_raw_text(html_content, start, end):
+    """
+    Whether the script/style start tag whose attributes span start:end
+    opens a raw-text element; '<script/>' does not, '<script src=a/>' does
+    """
+    pos = START_TAG_GAP_RE.match(html_content, start, end).end()
+    while pos < end:
+        match = START_TAG_ATTR_RE.match(html_content, pos, end)
+        if match is None:
+            break
+        pos = match.end()
+    return not html_content[pos:end].strip()
+
+def iter_links_from_html(html_content, base_url):
+    """
+    Yield unique video links from HTML in a single pass over the raw text.
+    Order matches the tree-based extractor: <a> links (yielded as they
+    are found), then <iframe> sources, then video IDs in inline scripts.
+    """
+    iframe_links = []
+    script_links = []
+    seen = set()
+    
+    pos = 0
+    while True:
+        match = LINK_TOKEN_RE.search(html_content, pos)
+        if match is None:
+            break
+        pos = match.end()
+        tag_name, attrs_text = match.groups()
+        if tag_name is None:
+            continue    # Comment, declaration or processing instruction
+        
+        if tag_name.lower() in RAW_TEXT_END_RE:
+            if not opens_raw_text(html_content, match.start(2), pos - 1):
+                continue
+            end = RAW_TEXT_END_RE[tag_name.lower()].search(html_content, pos)
+            if end is None:
+                break   # Like html.parser, an unclosed script/style swallows the rest of the page
+            
+            # Search in scripts
+            if tag_name.lower() == 'script':
+                for video_id in VIDEO_ID_RE.findall(html_content, pos, end.start()):
+                    script_links.append(f"{APARAT_BASE_URL}/v/{video_id}")
+            pos = end.end()
+            continue
+        
+        if tag_name.lower() == 'a':
+            # Search in <a> tags
+            href = parse_tag_attrs(attrs_text).get('href')
+            if href is None:
+                continue
+            
+            # Convert relative links to absolute
+            if href.startswith('/'):
+                href = urljoin(base_url, href)
+            
+            # Check if link is a video
+            if '/v/' in href and APARAT_DOMAIN in href:
+                link = href.split('?')[0]   # Remove query parameters
+                if link not in seen:
+                    seen.add(link)
+                    yield link
+        else:
+            # Search in iframe src attributes
+            src = parse_tag_attrs(attrs_text).get('src')
+            if src and APARAT_DOMAIN in src and '/v/' in src:
+                if src.startswith('/'):
+                    src = urljoin(base_url, src)
+                iframe_links.append(src.split('?')[0])
+    
+    for link in itertools.chain(iframe_links, script_links):
+        if link not in seen:
+            seen.add(link)
+            yield link
+
+def extract_links_from_html(html_content, base_url):
+    """Extract the list of unique video links from HTML"""
+    print("🔎 Searching for video links in HTML...")
+    
+    extraction_start = time.perf_counter()
+    unique_links = list(iter_links_from_html(html_content, base_url))
+    metrics.observe('link_extraction', time.perf_counter() - extraction_start, source='html')
+    
+    print_found_links(unique_links)
     
     return unique_links
 
+REQUEST_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'gzip, deflate',
+    'DNT': '1',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+}
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    """Return the shared requests.Session with a connection pool"""
+    import requests
+    
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE,
+                                                    pool_maxsize=HTTP_POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update(REQUEST_HEADERS)
+            _http_session = session
+        return _http_session
+
 def extract_with_requests(playlist_url):
     """
     Extract with requests (without JavaScript)
     """
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Accept-Encoding': 'gzip, deflate',
-        'DNT': '1',
-        'Connection': 'keep-alive',
-        'Upgrade-Insecure-Requests': '1',
-    }
-    
     try:
-        response = requests.get(playlist_url, headers=headers, timeout=30)
-        response.raise_for_status()
+        with metrics.phase('page_load', source='requests'):
+            response = get_http_session().get(playlist_url, timeout=30)
+            response.raise_for_status()
         
         # Extract links
         return extract_links_from_html(response.text, playlist_url)
@@ -202,25 +1033,241 @@ def extract_with_requests(playlist_url):
         print(f"❌ Error loading page: {e}")
         return []
 
+def get_playlist_id(playlist_url):
+    """Get numeric playlist id from a playlist URL"""
+    match = re.search(r'/playlist/(\d+)', playlist_url)
+    return match.group(1) if match else None
+
+def iter_api_video_ids(data):
+    """Yield video uids from one page of the playlist API response"""
+    items = []
+    for key in ('data', 'included'):
+        value = data.get(key)
+        if isinstance(value, list):
+            items.extend(value)
+        elif isinstance(value, dict):
+            items.append(value)
+    
+    for item in items:
+        if str(item.get('type', '')).lower() != 'video':
+            continue
+        attributes = item.get('attributes') or {}
+        uid = attributes.get('uid') or attributes.get('video_uid')
+        if uid:
+            yield uid
+
+def get_api_next_url(data):
+    """Get the next page URL from a playlist API response, if any"""
+    for container in (data, data.get('data') if isinstance(data.get('data'), dict) else None):
+        if not container:
+            continue
+        links = container.get('links') or {}
+        next_url = links.get('next') if isinstance(links, dict) else None
+        if next_url:
+            return next_url
+    return None
+
+PLAYLIST_LINK_RE = re.compile(r'''href\s*=\s*["']([^"']*/playlist/\d+[^"']*)["']''')
+
+class PlaylistCrawler:
+    """
+    Asyncio crawler for many playlists and channels at once.
+    Requests go through the shared pooled HTTP session, are bounded in
+    total and per host, and each host is paced like the download
+    scheduler. Links are streamed to the caller as they are found.
+    """
+    def __init__(self, concurrency=CRAWL_CONCURRENCY, per_host=CRAWL_PER_HOST):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.pacers = {}
+
+    async def _fetch(self, url, accept_json=False, source='requests'):
+        host = urlparse(url).netloc
+        if host not in self.host_slots:
+            self.host_slots[host] = asyncio.Semaphore(self.per_host)
+            self.pacers.setdefault(host, AdaptivePacer(min_delay=CRAWL_HOST_DELAY,
+                                                       initial_delay=CRAWL_HOST_DELAY))
+        pacer = self.pacers[host]
+        headers = {'Accept': 'application/json'} if accept_json else None
+        
+        def get(url):
+            pacer.wait()
+            try:
+                response = get_http_session().get(url, headers=headers, timeout=30)
+                response.raise_for_status()
+            except Exception:
+                pacer.record(False)
+                raise
+            pacer.record(True)
+            return response
+        
+        async with self.slots, self.host_slots[host]:
+            with metrics.phase('page_load', source=source):
+                return await asyncio.to_thread(retry_controller.call, get, url)
+
+    async def _iter_api_pages(self, playlist_url):
+        """
+        Yield the video links of each page of the playlist JSON API,
+        following pagination links (up to API_MAX_PAGES, no page twice)
+        """
+        playlist_id = get_playlist_id(playlist_url)
+        if not playlist_id:
+            return
+        next_url = f"{APARAT_API_BASE}/video/playlist/one/playlist_id/{playlist_id}"
+        visited = set()
+        while next_url and next_url not in visited and len(visited) < API_MAX_PAGES:
+            visited.add(next_url)
+            response = await self._fetch(next_url, accept_json=True, source='api')
+            data = response.json()
+            yield [f"{APARAT_BASE_URL}/v/{uid}" for uid in iter_api_video_ids(data)]
+            next_url = get_api_next_url(data)
+            if next_url:
+                next_url = urljoin(response.url, next_url)
+
+    async def _crawl_playlist(self, playlist_url, emit):
+        found = set()
+        
+        async def add(links):
+            for link in links:
+                if link not in found:
+                    found.add(link)
+                    await emit(playlist_url, link)
+        
+        # JSON API first, page by page
+        api_ok = False
+        try:
+            async for links in self._iter_api_pages(playlist_url):
+                await add(links)
+            api_ok = bool(found)
+        except Exception as e:
+            print(f"⚠️ Could not read playlist API for {playlist_url}: {e}")
+        
+        # Fall back to the static page, then to the browser
+        if not api_ok:
+            try:
+                response = await self._fetch(playlist_url)
+                with metrics.phase('link_extraction', source='crawler'):
+                    links = list(iter_links_from_html(response.text, playlist_url))
+                await add(links)
+            except Exception as e:
+                print(f"❌ Error loading page {playlist_url}: {e}")
+        if not found and SELENIUM_AVAILABLE:
+            await add(await asyncio.to_thread(extract_video_links_from_page, playlist_url))
+        
+        print(f"✅ {playlist_url}: {len(found)} links")
+        await emit(playlist_url, None)
+
+    async def _crawl_channel(self, channel_url, emit, seen_playlists):
+        try:
+            response = await self._fetch(channel_url)
+        except Exception as e:
+            print(f"❌ Error loading page {channel_url}: {e}")
+            await emit(channel_url, None)
+            return
+        
+        playlist_urls = []
+        for href in PLAYLIST_LINK_RE.findall(response.text):
+            playlist_url = urljoin(channel_url, html.unescape(href))
+            if get_playlist_id(playlist_url) not in seen_playlists:
+                seen_playlists.add(get_playlist_id(playlist_url))
+                playlist_urls.append(playlist_url)
+        
+        if playlist_urls:
+            print(f"📂 {channel_url}: {len(playlist_urls)} playlists")
+            await asyncio.gather(*(self._crawl_playlist(url, emit) for url in playlist_urls))
+        else:
+            # No playlists: treat the videos on the page as one list
+            for link in iter_links_from_html(response.text, channel_url):
+                await emit(channel_url, link)
+            await emit(channel_url, None)
+
+    async def crawl(self, urls, emit):
+        """Crawl playlist, channel and video URLs; await emit(playlist_url, video_url) per link"""
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.host_slots = {}
+        seen_playlists = {get_playlist_id(url) for url in urls} - {None}
+        
+        async def crawl_one(url):
+            try:
+                if get_playlist_id(url):
+                    await self._crawl_playlist(url, emit)
+                elif VIDEO_ID_RE.search(url):
+                    await emit(url, url)
+                    await emit(url, None)
+                else:
+                    await self._crawl_channel(url, emit, seen_playlists)
+            except Exception as e:
+                print(f"❌ Error crawling {url}: {e}")
+                await emit(url, None)
+        
+        await asyncio.gather(*(crawl_one(url) for url in dict.fromkeys(urls)))
+
+    def stream(self, urls):
+        """
+        Crawl in a background thread and yield (playlist_url, video_url)
+        as links are found; video_url None marks the end of a playlist.
+        """
+        results = queue.Queue(maxsize=CRAWL_QUEUE_SIZE)
+        finished = object()
+        
+        async def emit(playlist_url, video_url):
+            try:
+                results.put_nowait((playlist_url, video_url))
+            except queue.Full:
+                await asyncio.to_thread(results.put, (playlist_url, video_url))
+        
+        def run():
+            try:
+                asyncio.run(self.crawl(urls, emit))
+            finally:
+                results.put(finished)
+        
+        threading.Thread(target=run, daemon=True).start()
+        while True:
+            item = results.get()
+            if item is finished:
+                return
+            yield item
+
+def crawl_playlists(urls):
+    """
+    Yield (playlist_url, video_links) for each playlist as soon as it is
+    fully enumerated; channels expand into their playlists
+    """
+    pending = {}
+    for playlist_url, video_url in PlaylistCrawler().stream(urls):
+        if video_url is None:
+            yield playlist_url, pending.pop(playlist_url, [])
+        else:
+            pending.setdefault(playlist_url, []).append(video_url)
+
+def iter_playlist_videos(playlist_url):
+    """Yield playlist video links as they are discovered"""
+    for _, video_url in PlaylistCrawler().stream([playlist_url]):
+        if video_url is not None:
+            yield video_url
+
 def get_video_info_with_selenium(video_url):
     """
     Get video information using Selenium (for pages that need JavaScript)
     """
-    driver = setup_selenium_driver()
-    if not driver:
-        return None
-    
     try:
-        print(f"🌐 Loading video page: {video_url}")
-        driver.get(video_url)
-        
-        # Wait for video to load
-        time.sleep(5)
-        
-        # Try to get page source
-        page_html = driver.page_source
+        with browser_pool.driver() as driver:
+            if not driver:
+                return None
+            
+            print(f"🌐 Loading video page: {video_url}")
+            driver.get(video_url)
+            
+            # Wait for the title to render
+            wait_for_page_ready(driver, lambda d: d.execute_script(
+                "return document.querySelector('h1') !== null || document.title !== ''"))
+            
+            # Try to get page source
+            page_html = driver.page_source
         
         # Try to find video information in the page
+        from bs4 import BeautifulSoup
         soup = BeautifulSoup(page_html, 'html.parser')
         
         # Try to extract video title
@@ -229,8 +1276,6 @@ def get_video_info_with_selenium(video_url):
         if title_elem:
             title = title_elem.text.strip()
         
-        driver.quit()
-        
         return {
             'title': title[:100],  # Limit title length
             'webpage_url': video_url
@@ -238,21 +1283,157 @@ def get_video_info_with_selenium(video_url):
         
     except Exception as e:
         print(f"❌ Error loading video page with Selenium: {e}")
-        if driver:
-            driver.quit()
         return None
 
-def get_video_formats(video_url):
+def get_video_id(video_url):
+    """Get Aparat video id from a /v/<id> URL"""
+    match = re.search(r'/v/([a-zA-Z0-9_\-]+)', video_url)
+    return match.group(1) if match else None
+
+# Parts of the yt-dlp info dict the download needs (media URLs, headers, codecs)
+CACHED_INFO_KEYS = ('id', 'title', 'webpage_url', 'extractor', 'extractor_key', 'duration')
+CACHED_FORMAT_KEYS = ('format_id', 'url', 'manifest_url', 'protocol', 'ext', 'vcodec', 'acodec', 'width',
+                      'height', 'fps', 'tbr', 'filesize', 'filesize_approx', 'format_note', 'http_headers')
+
+def cacheable_info(info):
+    """Trimmed copy of a yt-dlp info dict that can be downloaded from without extracting again"""
+    if not info:
+        return None
+    trimmed = {key: info[key] for key in CACHED_INFO_KEYS if key in info}
+    trimmed['formats'] = [{key: fmt[key] for key in CACHED_FORMAT_KEYS if key in fmt}
+                          for fmt in info.get('formats') or []]
+    return trimmed
+
+class MetadataCache:
+    """
+    SQLite cache of get_video_formats results keyed by video id,
+    with a TTL and size-based LRU eviction. The trimmed info dict is
+    kept too, so a cache hit skips the extraction for the download.
+    """
+    def __init__(self, path=CACHE_FILE, ttl_hours=CACHE_TTL_HOURS, max_mb=CACHE_MAX_MB):
+        self.path = path
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def _connect(self):
+        if self.conn is None:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS formats (
+                    video_id TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            """)
+        return self.conn
+
+    def get(self, video_id):
+        """Return cached formats_info or None if missing or expired"""
+        with self.lock:
+            conn = self._connect()
+            now = time.time()
+            row = conn.execute("SELECT data FROM formats WHERE video_id = ? AND created > ?",
+                               (video_id, now - self.ttl_seconds)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE formats SET accessed = ? WHERE video_id = ?", (now, video_id))
+            conn.commit()
+            return json.loads(row[0])
+
+    def put(self, video_id, formats_info):
+        """Store title, format list and trimmed info dict for a video"""
+        data = json.dumps({
+            'title': formats_info['title'],
+            'formats': formats_info['formats'],
+            'webpage_url': formats_info['webpage_url'],
+            'info': cacheable_info(formats_info['info'])
+        }, ensure_ascii=False)
+        with self.lock:
+            conn = self._connect()
+            now = time.time()
+            conn.execute("INSERT OR REPLACE INTO formats VALUES (?, ?, ?, ?, ?)",
+                         (video_id, data, len(data.encode('utf-8')), now, now))
+            self._evict(conn)
+            conn.commit()
+
+    def delete(self, video_id):
+        """Drop a video's entry (e.g. its media URLs stopped working)"""
+        with self.lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM formats WHERE video_id = ?", (video_id,))
+            conn.commit()
+
+    def _evict(self, conn):
+        conn.execute("DELETE FROM formats WHERE created <= ?", (time.time() - self.ttl_seconds,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM formats").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for video_id, size in conn.execute("SELECT video_id, size FROM formats ORDER BY accessed").fetchall():
+            conn.execute("DELETE FROM formats WHERE video_id = ?", (video_id,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+metadata_cache = MetadataCache()
+atexit.register(metadata_cache.close)
+
+def get_video_formats(video_url, verbose=True, use_cache=None):
     """
-    Get available formats for a video using yt-dlp
+    Get available formats for a video using yt-dlp.
+    Results are served from the metadata cache when possible; a hit
+    carries the trimmed info dict (marked '__from_cache'), so the
+    download needs no new extraction. Entries from older versions
+    have no info dict, and the download extracts again.
     """
-    print(f"\n🔍 Getting available formats for video...")
+    import yt_dlp
+    
+    if verbose:
+        print(f"\n🔍 Getting available formats for video...")
+    
+    if use_cache is None:
+        use_cache = CACHE_ENABLED
+    video_id = get_video_id(video_url) if use_cache else None
+    
+    if video_id:
+        try:
+            cached = metadata_cache.get(video_id)
+        except sqlite3.Error as e:
+            print(f"⚠️ Metadata cache unavailable: {e}")
+            cached = None
+        if cached:
+            update_stats(run_counters, cache_hits=1)
+            formats = cached['formats']
+            info = cached.get('info')
+            if info:
+                info['__from_cache'] = True
+            return {
+                'title': cached['title'],
+                'formats': formats,
+                'best_format': formats[0] if formats else None,
+                'webpage_url': cached['webpage_url'],
+                'info': info
+            }
+        update_stats(run_counters, cache_misses=1)
     
     formats_info = {
         'title': 'Unknown Title',
         'formats': [],
         'best_format': None,
-        'webpage_url': video_url
+        'webpage_url': video_url,
+        'info': None
     }
     
     try:
@@ -265,9 +1446,13 @@ def get_video_formats(video_url):
         }
         
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(video_url, download=False)
+            with metrics.phase('format_probe', source='yt-dlp'):
+                info = retry_controller.call(lambda url: ydl.extract_info(url, download=False), video_url)
+            update_stats(run_counters, extractor_calls=1)
             
             if info:
+                # Keep the full info dict so the download can reuse it
+                formats_info['info'] = info
                 formats_info['title'] = info.get('title', 'Unknown Title')
                 formats_info['webpage_url'] = info.get('webpage_url', video_url)
                 
@@ -320,6 +1505,7 @@ def get_video_formats(video_url):
                                 'height': height,
                                 'width': width,
                                 'filesize_mb': round(filesize_mb, 2) if filesize_mb > 0 else "Unknown",
+                                'filesize_source': 'exact' if filesize_mb > 0 else None,
                                 'format_note': f.get('format_note', ''),
                                 'url': f.get('url', ''),
                                 'fps': fps
@@ -329,6 +1515,10 @@ def get_video_formats(video_url):
                     # Sort by height (quality) descending
                     video_formats.sort(key=lambda x: x['height'], reverse=True)
                     
+                    # Fill in sizes yt-dlp did not report
+                    with metrics.phase('size_probe'):
+                        resolve_format_sizes(video_formats, info)
+                    
                     formats_info['formats'] = video_formats
                     
                     # Find best format
@@ -343,40 +1533,136 @@ def get_video_formats(video_url):
         if video_info:
             formats_info['title'] = video_info['title']
     
+    # Only cache successful probes
+    if video_id and formats_info['formats']:
+        try:
+            metadata_cache.put(video_id, formats_info)
+        except sqlite3.Error as e:
+            print(f"⚠️ Could not update metadata cache: {e}")
+    
     return formats_info
 
-def display_and_select_format(formats_info, video_number, total_videos):
+_size_executor = None
+_size_executor_lock = threading.Lock()
+
+def probe_content_length(url, headers=None):
+    """Exact size of url from a HEAD request, or from a one-byte Range request if HEAD has none"""
+    headers = {**(headers or {}), 'Accept-Encoding': 'identity'}
+    response = get_http_session().head(url, headers=headers, allow_redirects=True, timeout=SIZE_PROBE_TIMEOUT)
+    length = response.headers.get('Content-Length', '')
+    if response.ok and length.isdigit() and int(length) > 0:
+        return int(length)
+    total, _ = probe_range_support(url, headers)
+    return total
+
+def estimate_format_size(raw_format, duration):
+    """Estimated size in bytes from filesize_approx or bitrate x duration, or None"""
+    if raw_format.get('filesize_approx'):
+        return raw_format['filesize_approx']
+    bitrate = raw_format.get('tbr') or (raw_format.get('vbr') or 0) + (raw_format.get('abr') or 0)
+    if bitrate and duration:
+        return bitrate * 1000 / 8 * duration     # tbr is in kbit/s
+    return None
+
+def resolve_format_sizes(formats, info):
     """
-    Display available formats and let user select one
+    Size-resolution stage for formats without a filesize. Progressive
+    URLs are sized exactly with concurrent pooled HEAD/Range requests;
+    the rest (and failed requests) are estimated. Sets filesize_mb and
+    filesize_source ('exact', 'estimated' or None when unknown).
     """
-    title = formats_info['title']
-    formats = formats_info['formats']
+    global _size_executor
+    with _size_executor_lock:
+        if _size_executor is None:
+            _size_executor = ThreadPoolExecutor(max_workers=SIZE_PROBE_WORKERS)
     
-    print(f"\n{'='*60}")
-    print(f"📹 Video {video_number}/{total_videos}: {title}")
-    print(f"🔗 URL: {formats_info['webpage_url']}")
-    print(f"{'='*60}")
-    
-    if not formats:
-        print("❌ No video formats found!")
-        print("Possible reasons:")
-        print("1. Video is private or requires login")
-        print("2. Video is not available in your region")
-        print("3. Website structure has changed")
-        
-        # Offer to skip or try alternative
-        choice = input("\n❓ What would you like to do? (s=skip, t=try alternative, q=quit): ").strip().lower()
-        
-        if choice == 's':
-            return None
-        elif choice == 't':
-            # Try with Selenium to get at least basic info
-            print("🔄 Trying alternative method...")
-            return get_video_info_with_selenium(formats_info['webpage_url'])
-        else:
-            return None
+    pending = []
+    for fmt in formats:
+        if fmt['filesize_source']:
+            continue
+        raw_format = find_raw_format(info, fmt['format_id']) or {}
+        future = None
+        if raw_format.get('url') and raw_format.get('protocol') in ('http', 'https'):
+            future = _size_executor.submit(probe_content_length, raw_format['url'], raw_format.get('http_headers'))
+        pending.append((fmt, raw_format, future))
     
-    # Display available formats
+    for fmt, raw_format, future in pending:
+        size = None
+        if future:
+            try:
+                size = future.result()
+            except Exception:
+                size = None     # Estimated below
+        source = 'exact'
+        if not size:
+            size = estimate_format_size(raw_format, info.get('duration'))
+            source = 'estimated'
+        if size:
+            fmt['filesize_mb'] = round(size / (1024 * 1024), 2)
+            fmt['filesize_source'] = source
+
+def format_size(fmt):
+    """Size column text; estimated sizes are prefixed with ~"""
+    size = fmt['filesize_mb']
+    if not isinstance(size, (int, float)):
+        return str(size)
+    prefix = "~" if fmt.get('filesize_source') == 'estimated' else ""
+    return f"{prefix}{size:.1f} MB"
+
+class FormatPrefetcher:
+    """
+    Look-ahead stage that resolves formats for the next videos in the
+    background. Items come from any iterable (a list or a lazy discovery
+    stream) and are yielded in order as (item, formats_info); at most
+    `ahead` probed items are held at a time.
+    url_of(item) returns the URL to probe, or None to pass the item
+    through without probing (formats_info is then None).
+    """
+    def __init__(self, items, ahead=PREFETCH_AHEAD, url_of=None):
+        self.items = items
+        self.ahead = max(1, ahead)
+        self.url_of = url_of or (lambda item: item)
+        self.executor = ThreadPoolExecutor(max_workers=self.ahead)
+        self.stage = queue.Queue(maxsize=self.ahead)
+        self.closed = threading.Event()
+        self.finished = object()
+
+    def _feed(self):
+        try:
+            for item in self.items:
+                if self.closed.is_set():
+                    return
+                url = self.url_of(item)
+                future = self.executor.submit(get_video_formats, url, False) if url else None
+                self.stage.put((item, future))
+        except Exception as e:
+            print(f"❌ Error while discovering videos: {e}")
+        finally:
+            self.stage.put(self.finished)
+
+    def __iter__(self):
+        threading.Thread(target=self._feed, daemon=True).start()
+        while True:
+            entry = self.stage.get()
+            if entry is self.finished:
+                return
+            item, future = entry
+            yield item, future.result() if future else None
+
+    def close(self):
+        """Cancel pending probes and stop the pool"""
+        self.closed.set()
+        try:
+            while True:
+                entry = self.stage.get_nowait()
+                if entry is not self.finished and entry[1]:
+                    entry[1].cancel()
+        except queue.Empty:
+            pass
+        self.executor.shutdown(wait=False)
+
+def print_formats_table(formats):
+    """Print a numbered table of formats from get_video_formats"""
     print(f"\n📊 Available formats ({len(formats)} options):")
     print("-" * 80)
     print(f"{'No.':<4} {'Quality':<10} {'Resolution':<12} {'Format':<8} {'Size':<10} {'FPS':<6} {'ID':<10}")
@@ -392,12 +1678,8 @@ def display_and_select_format(formats_info, video_number, total_videos):
         
         file_ext = fmt['ext']
         
-        # Handle size display
-        size_val = fmt['filesize_mb']
-        if isinstance(size_val, (int, float)):
-            size = f"{size_val:.1f} MB"
-        else:
-            size = str(size_val)
+        # Handle size display (~ marks an estimate)
+        size = format_size(fmt)
         
         # Handle FPS display safely
         fps_val = fmt['fps']
@@ -411,6 +1693,40 @@ def display_and_select_format(formats_info, video_number, total_videos):
         print(f"{i:<4} {quality:<10} {resolution:<12} {file_ext:<8} {size:<10} {fps:<6} {format_id:<10}")
     
     print("-" * 80)
+
+def display_and_select_format(formats_info, video_number, total_videos):
+    """
+    Display available formats and let user select one
+    """
+    title = formats_info['title']
+    formats = formats_info['formats']
+    
+    print(f"\n{'='*60}")
+    print(f"📹 Video {video_number}/{total_videos}: {title}")
+    print(f"🔗 URL: {formats_info['webpage_url']}")
+    print(f"{'='*60}")
+    
+    if not formats:
+        print("❌ No video formats found!")
+        print("Possible reasons:")
+        print("1. Video is private or requires login")
+        print("2. Video is not available in your region")
+        print("3. Website structure has changed")
+        
+        # Offer to skip or try alternative
+        choice = input("\n❓ What would you like to do? (s=skip, t=try alternative, q=quit): ").strip().lower()
+        
+        if choice == 's':
+            return None
+        elif choice == 't':
+            # Try with Selenium to get at least basic info
+            print("🔄 Trying alternative method...")
+            return get_video_info_with_selenium(formats_info['webpage_url'])
+        else:
+            return None
+    
+    # Display available formats
+    print_formats_table(formats)
     
     # Get user selection
     while True:
@@ -438,7 +1754,7 @@ def display_and_select_format(formats_info, video_number, total_videos):
                     print(f"\n{i}. {fmt['quality']} - ID: {fmt['format_id']}")
                     print(f"   Resolution: {fmt['width']}x{fmt['height']}")
                     print(f"   Format: {fmt['ext']}")
-                    print(f"   Size: {fmt['filesize_mb']}")
+                    print(f"   Size: {format_size(fmt)} ({fmt.get('filesize_source') or 'unknown'})")
                     if fmt['format_note']:
                         print(f"   Note: {fmt['format_note']}")
                 continue
@@ -456,31 +1772,1134 @@ def display_and_select_format(formats_info, video_number, total_videos):
         except ValueError:
             print("⚠️ Invalid input. Please enter a number or one of the letters (b,s,i,q)")
 
+# Default automatic quality selection policy
+DEFAULT_POLICY = {
+    'max_height': None,             # e.g. 720
+    'min_height': None,             # e.g. 360
+    'prefer_ext': None,             # e.g. 'mp4'
+    'prefer_fps': 'high',           # 'high' or 'low'
+    'max_size_mb': None,            # Per-video size cap (unknown sizes pass)
+    'fallback': ['lower', 'higher', 'skip']
+}
+
+FALLBACK_STEPS = ('lower', 'higher', 'best', 'smallest', 'skip')
+
+def load_quality_policy(policy_file=None, overrides=None):
+    """
+    Build a selection policy from DEFAULT_POLICY, an optional JSON
+    config file and command line overrides (None values are ignored)
+    """
+    policy = dict(DEFAULT_POLICY)
+    
+    if policy_file:
+        with open(policy_file, 'r', encoding='utf-8') as f:
+            policy.update(json.load(f))
+    
+    for key, value in (overrides or {}).items():
+        if value is not None:
+            policy[key] = value
+    
+    unknown = [step for step in policy['fallback'] if step not in FALLBACK_STEPS]
+    if unknown:
+        raise ValueError(f"Unknown fallback step(s): {', '.join(unknown)}")
+    if policy['prefer_fps'] not in ('high', 'low'):
+        raise ValueError("prefer_fps must be 'high' or 'low'")
+    
+    return policy
+
+def _within_size(fmt, max_size_mb):
+    size = fmt['filesize_mb']
+    return max_size_mb is None or not isinstance(size, (int, float)) or size <= max_size_mb
+
+def _rank_format(fmt, policy):
+    """Sort key: height first, then preferred ext, then fps preference"""
+    fps = fmt['fps'] or 0
+    return (
+        fmt['height'] or 0,
+        policy['prefer_ext'] is not None and fmt['ext'] == policy['prefer_ext'],
+        fps if policy['prefer_fps'] == 'high' else -fps
+    )
+
+def select_format_by_policy(formats, policy):
+    """
+    Pick a format from the get_video_formats list using the policy.
+    Returns None if the fallback order ends in 'skip' or nothing fits.
+    """
+    if not formats:
+        return None
+    
+    max_height = policy['max_height']
+    min_height = policy['min_height']
+    max_size_mb = policy['max_size_mb']
+    
+    def fits(fmt, check_min=True, check_max=True):
+        height = fmt['height'] or 0
+        if check_max and max_height is not None and height > max_height:
+            return False
+        if check_min and min_height is not None and height < min_height:
+            return False
+        return _within_size(fmt, max_size_mb)
+    
+    candidates = [fmt for fmt in formats if fits(fmt)]
+    if candidates:
+        return max(candidates, key=lambda fmt: _rank_format(fmt, policy))
+    
+    for step in policy['fallback']:
+        if step == 'lower':
+            candidates = [fmt for fmt in formats if fits(fmt, check_min=False)]
+            if candidates:
+                return max(candidates, key=lambda fmt: _rank_format(fmt, policy))
+        elif step == 'higher':
+            candidates = [fmt for fmt in formats if fits(fmt, check_max=False)]
+            if candidates:
+                return min(candidates, key=lambda fmt: fmt['height'] or 0)
+        elif step == 'best':
+            return formats[0]
+        elif step == 'smallest':
+            sized = [fmt for fmt in formats if isinstance(fmt['filesize_mb'], (int, float))]
+            return min(sized, key=lambda fmt: fmt['filesize_mb']) if sized else formats[-1]
+        elif step == 'skip':
+            return None
+    
+    return None
+
+def describe_policy(policy):
+    """One-line description of a selection policy"""
+    parts = []
+    if policy['min_height'] is not None:
+        parts.append(f"min {policy['min_height']}p")
+    if policy['max_height'] is not None:
+        parts.append(f"max {policy['max_height']}p")
+    if policy['prefer_ext']:
+        parts.append(f"prefer {policy['prefer_ext']}")
+    parts.append(f"{policy['prefer_fps']} fps")
+    if policy['max_size_mb'] is not None:
+        parts.append(f"max {policy['max_size_mb']} MB")
+    parts.append(f"fallback: {' > '.join(policy['fallback'])}")
+    return ", ".join(parts)
+
 def get_download_path():
     """Get download location from user"""
     default_path = "Aparat_Downloads"
     print(f"\n📁 Download Settings:")
     print("-" * 40)
     
-    download_path = input(f"Save location (Enter for default [{default_path}]): ").strip()
-    download_path = download_path if download_path else default_path
+    download_path = input(f"Save location (Enter for default [{default_path}]): ").strip()
+    download_path = download_path if download_path else default_path
+    
+    # Create folder
+    os.makedirs(download_path, exist_ok=True)
+    
+    return download_path
+
+class JobJournal:
+    """
+    Append-only, fsync'ed JSON-lines journal of per-video job states
+    (queued, probing, downloading, done, failed) for one playlist folder.
+    The latest record for each URL wins when the journal is replayed.
+    """
+    def __init__(self, folder, playlist_url=None):
+        self.path = os.path.join(folder, JOURNAL_FILE)
+        self.playlist_url = playlist_url
+        self.jobs = {}
+        self.last_progress = {}
+        self.lock = threading.Lock()
+        existed = os.path.exists(self.path)
+        self._load()
+        if not existed:
+            self._append({'playlist_url': playlist_url, 'created': time.time()})
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue    # Torn last line after a crash
+                if 'url' in record:
+                    self.jobs.setdefault(record['url'], {}).update(record)
+                elif self.playlist_url is None:
+                    self.playlist_url = record.get('playlist_url')
+
+    def _append(self, record):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def record(self, video_url, state, **fields):
+        """Record a new state for a video"""
+        record = {'url': video_url, 'state': state, 'time': time.time(), **fields}
+        with self.lock:
+            self.jobs.setdefault(video_url, {}).update(record)
+            self._append(record)
+
+    def record_progress(self, video_url, downloaded_bytes, total_bytes=None):
+        """Record download progress, at most every JOURNAL_PROGRESS_INTERVAL seconds"""
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_progress.get(video_url, 0) < JOURNAL_PROGRESS_INTERVAL:
+                return
+            self.last_progress[video_url] = now
+        self.record(video_url, 'downloading', bytes_done=downloaded_bytes, bytes_total=total_bytes)
+
+    def is_done(self, video_url):
+        """True if the video finished in an earlier run and its file still exists with the same size"""
+        job = self.jobs.get(video_url)
+        if not (job and job['state'] == 'done' and os.path.exists(job.get('filepath', ''))):
+            return False
+        return job.get('size') is None or os.path.getsize(job['filepath']) == job['size']
+
+def find_playlist_folder(download_path, playlist_url):
+    """
+    Return the newest Playlist_* folder whose journal belongs to playlist_url,
+    or a new timestamped folder path
+    """
+    if playlist_url and os.path.isdir(download_path):
+        candidates = sorted((name for name in os.listdir(download_path) if name.startswith('Playlist_')),
+                            reverse=True)
+        for name in candidates:
+            journal_path = os.path.join(download_path, name, JOURNAL_FILE)
+            if not os.path.exists(journal_path):
+                continue
+            try:
+                with open(journal_path, 'r', encoding='utf-8') as f:
+                    header = json.loads(f.readline())
+            except ValueError:
+                continue
+            if header.get('playlist_url') == playlist_url:
+                return os.path.join(download_path, name)
+    
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    folder = os.path.join(download_path, f"Playlist_{timestamp}")
+    suffix = 2
+    while os.path.exists(folder):
+        # Several playlists queued within the same second
+        folder = os.path.join(download_path, f"Playlist_{timestamp}_{suffix}")
+        suffix += 1
+    return folder
+
+def find_raw_format(video_info, format_id):
+    """Return the yt-dlp format dict with format_id from an info dict"""
+    for fmt in (video_info or {}).get('formats') or []:
+        if fmt.get('format_id') == format_id:
+            return fmt
+    return None
+
+def is_progressive_format(raw_format):
+    """True for single-file HTTP formats that contain both audio and video"""
+    if not raw_format or not raw_format.get('url'):
+        return False
+    return (raw_format.get('protocol') in ('http', 'https')
+            and raw_format.get('vcodec') != 'none'
+            and raw_format.get('acodec') != 'none')
+
+def format_bytes(num_bytes):
+    """Human readable size"""
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f}{unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f}TiB"
+
+class ProgressReporter:
+    """Build yt-dlp style progress events for our own downloaders"""
+    def __init__(self, total_bytes, hook, initial_bytes=0, filename=None):
+        self.total_bytes = total_bytes
+        self.hook = hook
+        self.filename = filename
+        self.downloaded = initial_bytes
+        self.initial = initial_bytes
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, num_bytes):
+        with self.lock:
+            self.downloaded += num_bytes
+            downloaded = self.downloaded
+        if not self.hook:
+            return
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        speed = (downloaded - self.initial) / elapsed
+        total = self.total_bytes
+        event = {
+            'status': 'downloading',
+            'filename': self.filename,
+            'downloaded_bytes': downloaded,
+            'total_bytes': total,
+            'speed': speed,
+            '_percent_str': f"{downloaded * 100 / total:.1f}%" if total else "N/A",
+            '_speed_str': f"{format_bytes(speed)}/s",
+            '_eta_str': f"{int((total - downloaded) / speed)}s" if total and speed > 0 else "N/A",
+        }
+        self.hook(event)
+
+    def finish(self, filepath):
+        if self.hook:
+            self.hook({'status': 'finished', 'filename': filepath,
+                       'downloaded_bytes': self.downloaded, 'total_bytes': self.total_bytes})
+
+class IntegrityError(IOError):
+    """Downloaded file failed a size, digest or container check"""
+
+# First bytes of the containers we may save (MP4 boxes, WebM/Matroska EBML)
+MP4_BOX_TYPES = (b'ftyp', b'styp', b'moov', b'free', b'skip', b'wide', b'mdat', b'sidx')
+EBML_MAGIC = b'\x1a\x45\xdf\xa3'
+TS_SYNC_BYTE = 0x47
+
+def check_container(head):
+    """Return an error message if head does not start an MP4, WebM or MPEG-TS file"""
+    if len(head) < 8:
+        return "File too small"
+    if head[4:8] in MP4_BOX_TYPES or head.startswith(EBML_MAGIC) or head[0] == TS_SYNC_BYTE:
+        return None
+    return f"Unknown container header {head[:8].hex()}"
+
+class ChunkedDigest:
+    """
+    File digest computed while bytes arrive: SHA-256 over the SHA-256 of
+    each DIGEST_CHUNK_MB chunk. Parallel segments hash the chunks that lie
+    inside them, so out-of-order writes need no second read of the file;
+    only chunks split between two segments are read back (fill_from).
+    """
+    def __init__(self, chunk_mb=DIGEST_CHUNK_MB):
+        self.chunk_mb = chunk_mb
+        self.chunk_size = int(chunk_mb * 1024 * 1024)
+        self.chunks = {}        # chunk index -> (sha256 bytes, length)
+        self.head = b''
+        self.lock = threading.Lock()
+
+    def writer(self, offset=0):
+        """Hasher for bytes written sequentially from offset (whole chunks only)"""
+        return ChunkWriter(self, offset)
+
+    def missing(self, total_size):
+        """Indexes of the chunks of a total_size file that were not hashed yet"""
+        with self.lock:
+            return [index for index in range(-(-total_size // self.chunk_size)) if index not in self.chunks]
+
+    def fill_from(self, path, indexes):
+        """Hash the given chunks from the file on disk"""
+        with open(path, 'rb') as f:
+            for index in indexes:
+                f.seek(index * self.chunk_size)
+                data = f.read(self.chunk_size)
+                with self.lock:
+                    self.chunks[index] = (hashlib.sha256(data).digest(), len(data))
+                    if index == 0:
+                        self.head = data[:16]
+
+    def commit(self, writer):
+        """Add the chunks of a finished writer"""
+        writer.close()
+        with self.lock:
+            self.chunks.update(writer.chunks)
+            if writer.head:
+                self.head = writer.head
+
+    @property
+    def size(self):
+        with self.lock:
+            return sum(length for _, length in self.chunks.values())
+
+    def hexdigest(self):
+        combined = hashlib.sha256()
+        with self.lock:
+            for index in range(len(self.chunks)):
+                if index not in self.chunks:
+                    raise IntegrityError(f"Chunk {index} was never hashed")
+                combined.update(self.chunks[index][0])
+        return combined.hexdigest()
+
+    def verify(self, expected_size=None):
+        """Raise IntegrityError if chunks are missing, the size is wrong or the container is unknown"""
+        self.hexdigest()
+        size = self.size
+        if expected_size is not None and size != expected_size:
+            raise IntegrityError(f"Size mismatch: got {size} of {expected_size} bytes")
+        error = check_container(self.head)
+        if error:
+            raise IntegrityError(error)
+
+class ChunkWriter:
+    """
+    Sequential part of a ChunkedDigest (a whole file, or one segment).
+    Bytes before the first chunk boundary at or after offset are skipped;
+    that chunk belongs to the previous segment or is read back later.
+    """
+    def __init__(self, digest, offset=0):
+        self.chunk_size = digest.chunk_size
+        self.index = -(-offset // self.chunk_size)
+        self.skip = self.index * self.chunk_size - offset
+        self.keep_head = offset == 0
+        self.head = b''
+        self.hash = hashlib.sha256()
+        self.filled = 0
+        self.chunks = {}
+
+    def update(self, data):
+        if self.keep_head and len(self.head) < 16:
+            self.head += data[:16 - len(self.head)]
+        view = memoryview(data)
+        if self.skip:
+            skipped = min(self.skip, len(view))
+            self.skip -= skipped
+            view = view[skipped:]
+        while view:
+            take = min(len(view), self.chunk_size - self.filled)
+            self.hash.update(view[:take])
+            self.filled += take
+            view = view[take:]
+            if self.filled == self.chunk_size:
+                self._end_chunk()
+
+    def _end_chunk(self):
+        self.chunks[self.index] = (self.hash.digest(), self.filled)
+        self.index += 1
+        self.hash = hashlib.sha256()
+        self.filled = 0
+
+    def close(self, keep_partial=True):
+        """End the last chunk; keep_partial=False drops it unless it is complete"""
+        if self.filled and keep_partial:
+            self._end_chunk()
+        self.filled = 0
+
+def digest_file(filepath, chunk_mb=DIGEST_CHUNK_MB):
+    """ChunkedDigest of a file on disk (for files written by yt-dlp or ffmpeg)"""
+    digest = ChunkedDigest(chunk_mb)
+    writer = digest.writer()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            writer.update(block)
+    digest.commit(writer)
+    return digest
+
+class Manifest:
+    """
+    Per-folder JSON-lines manifest of finished files (video id, format,
+    size, mtime and digest). The latest line for a file wins. A file whose
+    size and mtime still match its entry is confirmed without reading it.
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, MANIFEST_FILE)
+        self.entries = {}
+        self.lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue    # Torn last line after a crash
+                    self.entries[entry['file']] = entry
+
+    def record(self, filepath, video_id, format_id, digest, chunk_mb=DIGEST_CHUNK_MB):
+        """Add a finished file with its digest (hex)"""
+        stat = os.stat(filepath)
+        entry = {
+            'file': os.path.basename(filepath),
+            'id': video_id,
+            'format': format_id,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'digest': digest,
+            'chunk_mb': chunk_mb,
+            'time': time.time()
+        }
+        with self.lock:
+            self.entries[entry['file']] = entry
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        return entry
+
+    def get(self, filepath):
+        return self.entries.get(os.path.basename(filepath))
+
+    def check(self, filepath, deep=False):
+        """
+        Return 'ok', 'missing', 'unknown' (no entry), 'size' (size differs),
+        'changed' (mtime differs) or 'corrupt' (deep check digest differs)
+        """
+        entry = self.get(filepath)
+        if not os.path.exists(filepath):
+            return 'missing'
+        if entry is None:
+            return 'unknown'
+        stat = os.stat(filepath)
+        if stat.st_size != entry['size']:
+            return 'size'
+        if deep:
+            return 'ok' if digest_file(filepath, entry['chunk_mb']).hexdigest() == entry['digest'] else 'corrupt'
+        return 'ok' if stat.st_mtime_ns == entry['mtime_ns'] else 'changed'
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+def get_manifest(folder):
+    """Shared Manifest instance for a folder"""
+    folder = os.path.abspath(folder)
+    with _manifests_lock:
+        if folder not in _manifests:
+            _manifests[folder] = Manifest(folder)
+        return _manifests[folder]
+
+def probe_range_support(url, headers):
+    """Return (total_size, supports_range) using a one-byte Range request"""
+    response = get_http_session().get(url, headers={**headers, 'Range': 'bytes=0-0'},
+                                      stream=True, timeout=30)
+    try:
+        response.raise_for_status()
+        content_range = response.headers.get('Content-Range', '')
+        if response.status_code == 206 and '/' in content_range:
+            total = content_range.rsplit('/', 1)[1]
+            if total.isdigit():
+                return int(total), True
+        length = response.headers.get('Content-Length')
+        return (int(length) if length and length.isdigit() else None), False
+    finally:
+        response.close()
+
+def _download_single_stream(url, part_path, headers, reporter, digest):
+    """Plain streaming download (server does not support Range), restarted on failure"""
+    def attempt(url):
+        written = 0
+        writer = digest.writer()
+        try:
+            with get_http_session().get(url, headers=headers, stream=True, timeout=60) as response:
+                response.raise_for_status()
+                with open(part_path, 'wb') as f:
+                    for block in response.iter_content(chunk_size=256 * 1024):
+                        f.write(block)
+                        writer.update(block)
+                        written += len(block)
+                        reporter.add(len(block))
+            return writer
+        except Exception:
+            reporter.add(-written)
+            raise
+    
+    digest.commit(retry_controller.call(attempt, url))
+
+def _download_segment(url, part_path, headers, start, end, reporter, digest):
+    """
+    Fetch bytes start..end into the preallocated file, retrying on failure.
+    Returns the ChunkWriter that hashed the segment.
+    """
+    def attempt(url):
+        written = 0
+        writer = digest.writer(start)
+        try:
+            range_headers = {**headers, 'Range': f"bytes={start}-{end}"}
+            with get_http_session().get(url, headers=range_headers, stream=True, timeout=60) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise IOError(f"Expected 206 for segment, got {response.status_code}")
+                with open(part_path, 'r+b') as f:
+                    f.seek(start)
+                    for block in response.iter_content(chunk_size=256 * 1024):
+                        f.write(block)
+                        writer.update(block)
+                        written += len(block)
+                        reporter.add(len(block))
+            if written != end - start + 1:
+                raise TransferError(f"Segment {start}-{end} incomplete ({written} bytes)")
+            return writer
+        except Exception:
+            reporter.add(-written)
+            raise
+    
+    return retry_controller.call(attempt, url, max_attempts=SEGMENT_RETRIES + 1)
+
+def download_segmented(url, filepath, headers=None, progress_hook=None,
+                       connections=SEGMENT_CONNECTIONS, segment_size_mb=SEGMENT_SIZE_MB):
+    """
+    Download a progressive file over several pooled connections using
+    HTTP Range segments written in place into a preallocated .part file.
+    Finished segments are listed with their chunk digests in a .segments
+    file so an interrupted download resumes. Digest chunks split between
+    two segments are hashed from disk at the end (none when the segment
+    size is a multiple of DIGEST_CHUNK_MB). Falls back to a single
+    stream without Range support.
+    Returns the ChunkedDigest of the file, checked for size and container.
+    """
+    headers = dict(headers or {})
+    headers['Accept-Encoding'] = 'identity'   # Byte ranges must match the file
+    part_path = filepath + '.part'
+    done_path = filepath + '.segments'
+    digest = ChunkedDigest()
+    
+    total_size, supports_range = retry_controller.call(probe_range_support, url, headers)
+    if not supports_range or not total_size:
+        print("ℹ️ Server does not support Range requests, using a single connection")
+        reporter = ProgressReporter(total_size, progress_hook, filename=filepath)
+        _download_single_stream(url, part_path, headers, reporter, digest)
+        verify_part(digest, part_path, total_size)
+        os.replace(part_path, filepath)
+        reporter.finish(filepath)
+        return digest
+    
+    segment_size = max(1, int(segment_size_mb * 1024 * 1024))
+    segments = [(start, min(start + segment_size, total_size) - 1)
+                for start in range(0, total_size, segment_size)]
+    
+    # Segments finished by an earlier run ("start end chunk_digest..."), with their chunk digests
+    done = set()
+    if os.path.exists(part_path) and os.path.getsize(part_path) == total_size and os.path.exists(done_path):
+        with open(done_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                fields = line.split()
+                if (len(fields) < 2 or not fields[0].isdigit() or not fields[1].isdigit()
+                        or (int(fields[0]), int(fields[1])) not in segments):
+                    continue    # Other segment size, older version or torn
+                start = int(fields[0])
+                writer = digest.writer(start)
+                for offset, chunk_hex in enumerate(fields[2:]):
+                    index = writer.index + offset
+                    length = min(digest.chunk_size, total_size - index * digest.chunk_size)
+                    writer.chunks[index] = (bytes.fromhex(chunk_hex), length)
+                if start == 0:
+                    with open(part_path, 'rb') as part:
+                        writer.head = part.read(16)
+                digest.commit(writer)
+                done.add(start)
+    else:
+        with open(part_path, 'wb') as f:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(f.fileno(), 0, total_size)
+            else:
+                f.truncate(total_size)
+        open(done_path, 'w').close()
+    
+    todo = [seg for seg in segments if seg[0] not in done]
+    reporter = ProgressReporter(total_size, progress_hook, filename=filepath,
+                                initial_bytes=sum(end - start + 1 for start, end in segments if start in done))
+    
+    def fetch(segment):
+        writer = _download_segment(url, part_path, headers, segment[0], segment[1], reporter, digest)
+        # A last chunk cut off by the segment end is hashed from disk later
+        writer.close(keep_partial=segment[1] + 1 == total_size)
+        digest.commit(writer)
+        chunk_digests = " ".join(writer.chunks[index][0].hex() for index in sorted(writer.chunks))
+        append_to_file(done_path, f"{segment[0]} {segment[1]} {chunk_digests}".rstrip() + "\n")
+    
+    with ThreadPoolExecutor(max_workers=max(1, connections)) as executor:
+        # list() re-raises the first failed segment
+        list(executor.map(fetch, todo))
+    digest.fill_from(part_path, digest.missing(total_size))
+    
+    try:
+        verify_part(digest, part_path, total_size)
+    except IntegrityError:
+        os.remove(done_path)
+        raise
+    os.replace(part_path, filepath)
+    os.remove(done_path)
+    reporter.finish(filepath)
+    return digest
+
+def verify_part(digest, part_path, expected_size=None):
+    """Check a finished .part file; a file that fails is deleted so the next try starts clean"""
+    try:
+        digest.verify(expected_size)
+    except IntegrityError:
+        os.remove(part_path)
+        raise
+
+def is_hls_format(raw_format):
+    """True for HLS formats that contain both audio and video"""
+    if not raw_format or not raw_format.get('url'):
+        return False
+    return (raw_format.get('protocol') in ('m3u8', 'm3u8_native')
+            and raw_format.get('vcodec') != 'none'
+            and raw_format.get('acodec') != 'none')
+
+class UnsupportedPlaylist(Exception):
+    """HLS playlist feature we do not handle (left to yt-dlp)"""
+
+def parse_m3u8(text, playlist_url):
+    """
+    Parse an HLS playlist.
+    Returns ('master', [variant urls by bandwidth desc]) or
+    ('media', [init segment url or None, [fragment urls]]).
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines or lines[0] != '#EXTM3U':
+        raise UnsupportedPlaylist("Not an M3U8 playlist")
+    
+    variants = []
+    fragments = []
+    init_url = None
+    for i, line in enumerate(lines):
+        if line.startswith('#EXT-X-STREAM-INF'):
+            match = re.search(r'BANDWIDTH=(\d+)', line)
+            if i + 1 < len(lines) and not lines[i + 1].startswith('#'):
+                variants.append((int(match.group(1)) if match else 0, urljoin(playlist_url, lines[i + 1])))
+        elif line.startswith('#EXT-X-KEY') and 'METHOD=NONE' not in line:
+            raise UnsupportedPlaylist("Encrypted fragments")
+        elif line.startswith('#EXT-X-BYTERANGE'):
+            raise UnsupportedPlaylist("Byte-range fragments")
+        elif line.startswith('#EXT-X-MAP'):
+            match = re.search(r'URI="([^"]+)"', line)
+            if match:
+                init_url = urljoin(playlist_url, match.group(1))
+        elif not line.startswith('#') and not (i > 0 and lines[i - 1].startswith('#EXT-X-STREAM-INF')):
+            fragments.append(urljoin(playlist_url, line))
+    
+    if variants:
+        variants.sort(reverse=True)
+        return 'master', [url for _, url in variants]
+    return 'media', [init_url, fragments]
+
+class FragmentBuffer:
+    """
+    Byte budget for HLS fragments fetched ahead of the writer.
+    A fragment reserves its Content-Length before its body is read and
+    releases it once written. The fragment the writer needs next never
+    waits (and is not counted), so a large fragment cannot stall the stream.
+    """
+    def __init__(self, budget, next_index=0):
+        self.budget = budget
+        self.next_index = next_index
+        self.held = {}          # fragment index -> reserved bytes
+        self.buffered = 0
+        self.peak = 0
+        self.cancelled = False
+        self.condition = threading.Condition()
+
+    def reserve(self, index, size):
+        """Wait until size more bytes fit in the budget (or index is next to be written)"""
+        with self.condition:
+            while (index != self.next_index and not self.cancelled
+                   and self.buffered + size > self.budget):
+                self.condition.wait()
+            if index == self.next_index or self.cancelled:
+                return
+            self.held[index] = self.held.get(index, 0) + size
+            self.buffered += size
+            self.peak = max(self.peak, self.buffered)
+
+    def release(self, index):
+        """Give back the bytes reserved for index (failed attempt)"""
+        with self.condition:
+            self.buffered -= self.held.pop(index, 0)
+            self.condition.notify_all()
+
+    def written(self, index):
+        """index was written; the next fragment may go ahead"""
+        with self.condition:
+            self.buffered -= self.held.pop(index, 0)
+            self.next_index = index + 1
+            self.condition.notify_all()
+
+    def cancel(self):
+        """Stop waiting, the download is being abandoned"""
+        with self.condition:
+            self.cancelled = True
+            self.condition.notify_all()
+
+def _fetch_fragment(url, headers, buffer=None, index=None):
+    """
+    Download one fragment, retrying only this fragment on failure.
+    With a buffer, the body is read once its size fits in the budget.
+    """
+    def fetch(url):
+        response = get_http_session().get(url, headers=headers, timeout=60, stream=buffer is not None)
+        try:
+            response.raise_for_status()
+            if buffer is None:
+                return response.content
+            
+            size = response.headers.get('Content-Length')
+            if size and size.isdigit():
+                buffer.reserve(index, int(size))
+            try:
+                data = response.content
+                if not (size and size.isdigit()):
+                    buffer.reserve(index, len(data))    # Size only known now
+            except BaseException:
+                buffer.release(index)
+                raise
+            return data
+        finally:
+            response.close()
+    
+    return retry_controller.call(fetch, url, max_attempts=HLS_FRAGMENT_RETRIES + 1)
+
+def download_hls(playlist_url, filepath, headers=None, progress_hook=None,
+                 workers=HLS_FRAGMENT_WORKERS, max_buffer_mb=HLS_MAX_BUFFER_MB):
+    """
+    Download an HLS stream fetching fragments in parallel.
+    Fragments fetched ahead of the writer are held within the byte
+    budget; they are written to the output in order as they complete.
+    Raises UnsupportedPlaylist for encrypted or byte-range streams.
+    The written fragment count and offset are checkpointed, so an
+    interrupted download resumes after its last written fragment.
+    MPEG-TS streams are saved as they are and remuxed into MP4 by the
+    post-processing stage. Returns the ChunkedDigest of the saved file.
+    """
+    headers = dict(headers or {})
+    session = get_http_session()
     
-    # Create folder
-    os.makedirs(download_path, exist_ok=True)
+    response = session.get(playlist_url, headers=headers, timeout=30)
+    response.raise_for_status()
+    kind, parsed = parse_m3u8(response.text, response.url)
+    if kind == 'master':
+        response = session.get(parsed[0], headers=headers, timeout=30)
+        response.raise_for_status()
+        kind, parsed = parse_m3u8(response.text, response.url)
+        if kind != 'media':
+            raise UnsupportedPlaylist("Nested master playlists")
     
-    return download_path
+    init_url, fragment_urls = parsed
+    urls = ([init_url] if init_url else []) + fragment_urls
+    if not urls:
+        raise UnsupportedPlaylist("Playlist has no fragments")
+    
+    part_path = filepath + '.part'
+    done_path = filepath + '.fragments'
+    budget = max_buffer_mb * 1024 * 1024
+    digest = ChunkedDigest()
+    writer = digest.writer()
+    
+    # Checkpoint of an earlier run: first line is the fragment count,
+    # then one "fragments_written bytes_written" line per written fragment
+    start_index, offset = 0, 0
+    if os.path.exists(part_path) and os.path.exists(done_path):
+        with open(done_path, 'r', encoding='utf-8') as f:
+            lines = f.read().split('\n')
+        if lines[0].strip() == str(len(urls)):
+            for line in lines[1:-1]:    # The last piece has no newline (empty or torn)
+                fields = line.split()
+                if len(fields) == 2 and fields[0].isdigit() and fields[1].isdigit():
+                    start_index, offset = int(fields[0]), int(fields[1])
+        if os.path.getsize(part_path) < offset:
+            start_index, offset = 0, 0
+    
+    if start_index:
+        # Bytes from the earlier run are hashed once from disk
+        with open(part_path, 'rb') as part:
+            remaining = offset
+            while remaining:
+                block = part.read(min(remaining, digest.chunk_size))
+                writer.update(block)
+                remaining -= len(block)
+        print(f"♻️ Resuming HLS download at fragment {start_index + 1}/{len(urls)}")
+    else:
+        with open(done_path, 'w', encoding='utf-8') as f:
+            f.write(f"{len(urls)}\n")
+    
+    average_size = offset // start_index if start_index else 1024 * 1024    # Fragment size estimate
+    reporter = ProgressReporter(None, progress_hook, initial_bytes=offset, filename=filepath)
+    buffer = FragmentBuffer(budget, start_index)
+    futures = {}
+    
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        try:
+            # Waiting fragments only keep a pending future; buffer bounds the fetched bytes
+            for index in range(start_index, len(urls)):
+                futures[index] = executor.submit(_fetch_fragment, urls[index], headers, buffer, index)
+            
+            with open(part_path, 'r+b' if start_index else 'wb') as out:
+                out.seek(offset)
+                out.truncate()
+                for next_write in range(start_index, len(urls)):
+                    data = futures.pop(next_write).result()
+                    out.write(data)
+                    out.flush()
+                    buffer.written(next_write)
+                    writer.update(data)
+                    append_to_file(done_path, f"{next_write + 1} {out.tell()}\n")
+                    
+                    written = next_write + 1
+                    average_size = max(1, (average_size * next_write + len(data)) // written)
+                    reporter.total_bytes = reporter.downloaded + len(data) + average_size * (len(urls) - written)
+                    reporter.add(len(data))
+        except BaseException:
+            buffer.cancel()
+            for future in futures.values():
+                future.cancel()
+            raise
+    
+    digest.commit(writer)
+    try:
+        verify_part(digest, part_path)
+    finally:
+        os.remove(done_path)
+    
+    # Fragmented MP4 is already an MP4 file; MPEG-TS is remuxed off the download thread
+    os.replace(part_path, filepath)
+    reporter.finish(filepath)
+    return digest
+
+def remux_to_mp4(filepath):
+    """Remux an MPEG-TS or WebM/Matroska file saved as .mp4 into an MP4 container"""
+    with open(filepath, 'rb') as f:
+        head = f.read(16)
+    if head[4:8] in MP4_BOX_TYPES:
+        return None
+    if head[:1] == bytes([TS_SYNC_BYTE]):
+        input_format = 'mpegts'
+    elif head.startswith(EBML_MAGIC):
+        input_format = 'matroska'
+    else:
+        return None
+    if not shutil.which('ffmpeg'):
+        print(f"⚠️ ffmpeg not found, keeping {os.path.basename(filepath)} without remuxing")
+        return None
+    
+    temp_path = filepath + '.remux.mp4'
+    result = subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', input_format, '-i', filepath,
+                             '-c', 'copy', '-f', 'mp4', temp_path], capture_output=True)
+    if result.returncode != 0:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise IOError(f"ffmpeg remux failed: {result.stderr.decode(errors='replace')[:200]}")
+    # Written into the same inode, so hardlinks to the store see the remuxed file
+    shutil.copyfile(temp_path, filepath)
+    os.remove(temp_path)
+    return filepath
+
+def extract_audio(filepath):
+    """Copy the audio track into a .m4a file next to the video"""
+    audio_path = os.path.splitext(filepath)[0] + '.m4a'
+    if os.path.exists(audio_path):
+        return None
+    if not shutil.which('ffmpeg'):
+        print(f"⚠️ ffmpeg not found, no audio extracted from {os.path.basename(filepath)}")
+        return None
+    
+    temp_path = audio_path + '.part'
+    result = subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-i', filepath,
+                             '-vn', '-c:a', 'copy', '-f', 'mp4', temp_path], capture_output=True)
+    if result.returncode != 0:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise IOError(f"ffmpeg audio extraction failed: {result.stderr.decode(errors='replace')[:200]}")
+    os.replace(temp_path, audio_path)
+    return audio_path
+
+def stub_postprocess(filepath):
+    """Test step: CPU-bound busy work for POSTPROCESS_STUB_SECONDS, writes nothing"""
+    deadline = time.process_time() + POSTPROCESS_STUB_SECONDS
+    block = filepath.encode()
+    while time.process_time() < deadline:
+        block = hashlib.sha256(block * 4096).digest()
+    return None
+
+# Post-processing steps by name: step(filepath) returns the path it wrote, or None
+POSTPROCESSORS = {
+    'remux_mp4': remux_to_mp4,
+    'extract_audio': extract_audio,
+    'stub': stub_postprocess,
+}
+
+def run_postprocess_steps(filepath, steps):
+    """
+    Run (name, step) pairs on one file in a pool process. Steps are
+    passed as functions, so any module-level function can be plugged in.
+    Returns step timings and the new digest if the file was rewritten.
+    """
+    timings = []
+    written = []
+    for name, step in steps:
+        started = time.perf_counter()
+        output = step(filepath)
+        timings.append((name, time.perf_counter() - started))
+        if output:
+            written.append(output)
+    digest = digest_file(filepath) if filepath in written else None
+    return {
+        'timings': timings,
+        'written': written,
+        'digest': digest.hexdigest() if digest else None,
+        'chunk_mb': digest.chunk_mb if digest else None,
+    }
+
+class PostProcessor:
+    """
+    Post-processing stage. Downloads hand finished files to a bounded
+    queue, and a dispatcher thread feeds them to a process pool sized to
+    the CPU count, so CPU-bound steps never hold a download thread.
+    """
+    def __init__(self, steps=POSTPROCESS_STEPS, workers=POSTPROCESS_WORKERS, queue_size=POSTPROCESS_QUEUE_SIZE):
+        self.steps = list(steps)
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.executor = None
+        self.dispatcher = None
+        self.slots = None
+        self.processed = 0
+        self.failed = 0
+
+    def configure(self, steps=None, workers=None):
+        unknown = [step for step in (steps or []) if step not in POSTPROCESSORS]
+        if unknown:
+            raise ValueError(f"Unknown post-processing step(s): {', '.join(unknown)}")
+        if steps is not None:
+            self.steps = list(steps)
+        if workers:
+            self.workers = workers
+
+    def submit(self, filepath, video_id, format_id, manifest_paths, journal=None, video_url=None):
+        """
+        Hand a finished file to the stage (blocks while the queue is full).
+        If a step rewrites the file, its manifests and its 'done' journal
+        record are updated so the next run does not download it again.
+        """
+        if not self.steps:
+            return
+        with self.lock:
+            if self.dispatcher is None:
+                # spawn: forking while download threads hold locks could copy them held
+                self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                    mp_context=multiprocessing.get_context('spawn'))
+                self.slots = threading.Semaphore(self.workers)
+                self.dispatcher = threading.Thread(target=self._dispatch, args=(self.executor,), daemon=True)
+                self.dispatcher.start()
+        self.queue.put((filepath, video_id, format_id, manifest_paths, journal, video_url))
+
+    def _dispatch(self, executor):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            # Files wait in the queue (not the pool) until a process is free
+            self.slots.acquire()
+            steps = [(name, POSTPROCESSORS[name]) for name in self.steps]
+            try:
+                future = executor.submit(run_postprocess_steps, job[0], steps)
+            except Exception as e:
+                self.slots.release()
+                self._failed(job[0], e)
+                continue
+            future.add_done_callback(lambda future, job=job: self._finished(future, job))
+
+    def _failed(self, filepath, error):
+        with self.lock:
+            self.failed += 1
+        print(f"❌ Post-processing failed for {os.path.basename(filepath)}: {str(error)[:200]}")
+        append_to_file(
+            os.path.join(os.path.dirname(filepath), 'errors.txt'),
+            f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+            f"Post-processing {filepath}\nError: {str(error)}\n\n"
+        )
+
+    def _finished(self, future, job):
+        filepath, video_id, format_id, manifest_paths, journal, video_url = job
+        self.slots.release()
+        try:
+            result = future.result()
+        except Exception as e:
+            self._failed(filepath, e)
+            return
+        
+        for name, seconds in result['timings']:
+            metrics.observe('post_processing', seconds, step=name)
+        if result['digest']:
+            # The file was rewritten in place; update the manifests of every path sharing it
+            for path in manifest_paths:
+                if os.path.exists(path) and os.path.samefile(path, filepath):
+                    get_manifest(os.path.dirname(path)).record(path, video_id, format_id,
+                                                               result['digest'], result['chunk_mb'])
+            if journal:
+                journal.record(video_url, 'done', filepath=filepath, size=os.path.getsize(filepath))
+        with self.lock:
+            self.processed += 1
 
-def download_video_with_format(video_url, selected_format, download_path, video_number, total_videos, stats):
+    def drain(self):
+        """Wait until every handed-off file is processed, then stop the pool"""
+        with self.lock:
+            dispatcher, executor = self.dispatcher, self.executor
+            self.dispatcher = self.executor = None
+        if dispatcher is None:
+            return
+        print("\n⏳ Waiting for post-processing to finish...")
+        self.queue.put(None)
+        dispatcher.join()
+        executor.shutdown(wait=True)
+        print(f"🛠️ Post-processed {self.processed} files ({self.failed} failed)")
+
+post_processor = PostProcessor()
+
+class ContentStore:
+    """
+    Media store keyed by video id and format id. Each file is downloaded
+    once and linked into every playlist folder that contains the video.
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def path_for(self, video_id, format_id):
+        """Store path of a video in a given format"""
+        safe_id = re.sub(r'[^\w\-]', '_', video_id)
+        safe_format = re.sub(r'[^\w\-]', '_', format_id)
+        folder = os.path.join(self.root, safe_id)
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, f"{safe_format}.mp4")
+
+    @staticmethod
+    def link_into(store_file, target):
+        """Hardlink store_file to target, falling back to a symlink or a copy"""
+        if os.path.lexists(target):
+            return
+        try:
+            os.link(store_file, target)
+        except OSError:
+            try:
+                os.symlink(os.path.relpath(store_file, os.path.dirname(target)), target)
+            except OSError:
+                shutil.copy2(store_file, target)
+
+def download_video_with_format(video_url, selected_format, download_path, video_number, total_videos, stats,
+                               video_info=None, journal=None, store=None):
     """
-    Download a single video with selected format
+    Download a single video with selected format.
+    If video_info (from get_video_formats) is given, it is downloaded
+    directly without extracting the page again. Partial files from an
+    earlier run are resumed. With a ContentStore the media goes to the
+    store (once per video and format) and is linked into download_path.
     """
+    import yt_dlp
+    
+    video_bucket = bandwidth_limiter.new_video_bucket()
+    progress_label = f"Video {video_number}"
+    last_bytes = {}
+    progress_lock = threading.Lock()
+    
+    def progress_hook(d):
+        # Every download path reports here, so this is where bandwidth is governed
+        if d['status'] == 'downloading' and d.get('downloaded_bytes') is not None:
+            with progress_lock:
+                key = d.get('filename')
+                done = d['downloaded_bytes']
+                delta = max(0, done - last_bytes.get(key, 0))
+                last_bytes[key] = max(done, last_bytes.get(key, 0))
+            bandwidth_limiter.throttle(delta, video_bucket)
+        
+        progress_dashboard.hook(video_url, progress_label, d)
+        if journal and d['status'] == 'downloading':
+            journal.record_progress(video_url, d.get('downloaded_bytes'),
+                                    d.get('total_bytes') or d.get('total_bytes_estimate'))
+    
+    circuit_url = video_url     # Failures count against the media host once the format is known
+    
     try:
         # Get video info for title
-        ydl_opts_info = {'quiet': True}
-        with yt_dlp.YoutubeDL(ydl_opts_info) as ydl:
-            video_info = ydl.extract_info(video_url, download=False)
-            video_title = video_info.get('title', f'Video_{video_number}')
-            video_id = video_info.get('id', str(video_number))
+        if video_info is None:
+            ydl_opts_info = {'quiet': True}
+            with yt_dlp.YoutubeDL(ydl_opts_info) as ydl:
+                with metrics.phase('format_probe', source='download'):
+                    video_info = ydl.extract_info(video_url, download=False)
+                update_stats(run_counters, extractor_calls=1)
+        video_title = video_info.get('title', f'Video_{video_number}')
+        video_id = video_info.get('id', str(video_number))
         
         # Clean title for filename
         safe_title = re.sub(r'[^\w\-_\. ]', '_', video_title)
@@ -495,141 +2914,831 @@ def download_video_with_format(video_url, selected_format, download_path, video_
         print(f"🎯 Quality: {selected_format['quality']}")
         print(f"💾 Saving as: {filename}")
         
+        # Download into the content store when one is used
+        if store:
+            target = store.path_for(get_video_id(video_url) or video_id, selected_format['format_id'])
+        else:
+            target = filepath
+        
         # yt-dlp options for specific format
         ydl_opts = {
-            'outtmpl': filepath,
+            'outtmpl': target,
             'format': selected_format['format_id'],
             'quiet': False,
             'no_warnings': False,
-            'ignoreerrors': True,
+            'ignoreerrors': False,     # Errors are classified below
             'nooverwrites': True,
-            'retries': 3,
-            'fragment_retries': 3,
-            'progress_hooks': [lambda d: print_progress(d, video_number)],
+            'continuedl': True,
+            'retries': RETRY_MAX_ATTEMPTS,
+            'fragment_retries': HLS_FRAGMENT_RETRIES,
+            'retry_sleep_functions': {'http': retry_controller.backoff,
+                                      'fragment': retry_controller.backoff},
+            'concurrent_fragment_downloads': HLS_FRAGMENT_WORKERS,
+            'noprogress': True,        # Progress is drawn by progress_dashboard
+            'progress_hooks': [progress_hook],
+            # No remux/fixup steps in the download slot; post_processor runs them in its pool
+            'fixup': 'never',
+            'postprocessors': [],
         }
         
         # Download video
+        if journal:
+            journal.record(video_url, 'downloading', filepath=filepath, format_id=selected_format['format_id'])
         start_time = time.time()
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([video_url])
+        raw_format = find_raw_format(video_info, selected_format['format_id'])
+        # Same host key as DownloadScheduler._run, so a throttled CDN pauses its own downloads
+        circuit_url = (raw_format or {}).get('url') or video_url
+        manifest_id = get_video_id(video_url) or video_id
+        target_manifest = get_manifest(os.path.dirname(target))
+        digest = None
+        downloaded = os.path.exists(target)
+        linked = False
+        transfer_path = 'existing'
+        if downloaded:
+            # Confirm the existing file from the manifest (stat only; hashed if its mtime changed)
+            status = target_manifest.check(target)
+            if status == 'changed':
+                status = target_manifest.check(target, deep=True)
+            if status in ('size', 'corrupt'):
+                print(f"⚠️ Existing file does not match the manifest ({status}), downloading again")
+                os.remove(target)
+                downloaded = False
+            elif status == 'unknown':
+                digest = digest_file(target)    # File from before manifests, hashed once
+            elif store:
+                print("🔗 Already in store, linking instead of downloading")
+                linked = True
+        if not downloaded and SEGMENTED_DOWNLOADS and is_progressive_format(raw_format):
+            # Progressive file: fetch in parallel Range segments
+            digest = download_segmented(raw_format['url'], target, raw_format.get('http_headers'), progress_hook)
+            downloaded = True
+            transfer_path = 'segmented'
+        elif not downloaded and HLS_PARALLEL and is_hls_format(raw_format):
+            # HLS stream: fetch fragments in parallel within a byte budget
+            try:
+                digest = download_hls(raw_format['url'], target, raw_format.get('http_headers'), progress_hook)
+                downloaded = True
+                transfer_path = 'hls'
+            except UnsupportedPlaylist as e:
+                print(f"ℹ️ {e}, downloading with yt-dlp")
+        
+        if not downloaded:
+            transfer_path = 'yt-dlp'
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                # Download from the already extracted info (no new extraction)
+                ydl.process_ie_result(video_info, download=True)
+            if os.path.exists(target):
+                # yt-dlp wrote the file itself, so it is hashed from disk once
+                digest = digest_file(target)
+                try:
+                    digest.verify()
+                except IntegrityError:
+                    os.remove(target)
+                    raise
         
         download_time = time.time() - start_time
+        metrics.observe('transfer', download_time, path=transfer_path, video=video_number,
+                        bytes=os.path.getsize(target) if os.path.exists(target) else 0)
+        
+        if digest is not None:
+            target_manifest.record(target, manifest_id, selected_format['format_id'],
+                                   digest.hexdigest(), digest.chunk_mb)
+        
+        if store and os.path.exists(target):
+            store.link_into(target, filepath)
+            entry = target_manifest.get(target)
+            get_manifest(download_path).record(filepath, manifest_id, selected_format['format_id'],
+                                               entry['digest'], entry['chunk_mb'])
+        
+        if linked and os.path.exists(filepath):
+            # Counted (and post-processed) when it was downloaded; only the link is new
+            update_stats(stats, linked=1)
+            if journal:
+                journal.record(video_url, 'done', filepath=filepath, size=os.path.getsize(filepath))
+            print(f"\n✅ Linked from store: {filename}")
+            return True
         
         # Check if file was downloaded
         if os.path.exists(filepath):
             file_size = os.path.getsize(filepath) / (1024 * 1024)  # MB
-            stats['downloaded'] += 1
-            stats['total_size_mb'] += file_size
+            update_stats(stats, downloaded=1, total_size_mb=file_size)
+            if journal:
+                journal.record(video_url, 'done', filepath=filepath, size=os.path.getsize(filepath))
+            
+            # Remuxing and other CPU-bound steps run in the post-processing pool
+            post_processor.submit(filepath, manifest_id, selected_format['format_id'], [target, filepath],
+                                  journal, video_url)
             
             print(f"\n✅ Download completed in {download_time:.1f} seconds")
             print(f"💾 File size: {file_size:.2f} MB")
             
             # Save download info
-            with open(os.path.join(download_path, 'download_log.txt'), 'a', encoding='utf-8') as f:
-                f.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ")
-                f.write(f"Video {video_number}: {video_title} | ")
-                f.write(f"Quality: {selected_format['quality']} | ")
-                f.write(f"Size: {file_size:.2f} MB | ")
-                f.write(f"URL: {video_url}\n")
+            append_to_file(
+                os.path.join(download_path, 'download_log.txt'),
+                f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+                f"Video {video_number}: {video_title} | "
+                f"Quality: {selected_format['quality']} | "
+                f"Size: {file_size:.2f} MB | "
+                f"URL: {video_url}\n"
+            )
             
             return True
         else:
             print("❌ Download failed - File not created")
-            stats['failed'] += 1
+            update_stats(stats, failed=1)
+            if journal:
+                journal.record(video_url, 'failed', error="File not created")
             return False
             
     except Exception as e:
-        print(f"❌ Error downloading video: {str(e)[:200]}")
-        stats['failed'] += 1
+        kind = classify_error(e)
+        if kind == 'permanent' and video_info and video_info.get('__from_cache'):
+            # Cached media URLs may have expired: drop the entry and extract the page once more
+            print(f"ℹ️ Cached video info failed ({str(e)[:100]}), extracting the page again")
+            try:
+                metadata_cache.delete(get_video_id(video_url))
+            except sqlite3.Error:
+                pass
+            return download_video_with_format(video_url, selected_format, download_path, video_number,
+                                              total_videos, stats, None, journal, store)
+        print(f"❌ Error downloading video ({kind}): {str(e)[:200]}")
+        update_stats(stats, failed=1)
+        if not getattr(e, 'circuit_counted', False):
+            retry_controller.record_failure(circuit_url, kind, get_retry_after(e))
+        if journal:
+            journal.record(video_url, 'failed', error=str(e)[:500], error_kind=kind)
         
         # Save error
-        with open(os.path.join(download_path, 'errors.txt'), 'a', encoding='utf-8') as f:
-            f.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ")
-            f.write(f"Video {video_number}: {video_url}\n")
-            f.write(f"Error: {str(e)}\n\n")
+        append_to_file(
+            os.path.join(download_path, 'errors.txt'),
+            f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] "
+            f"Video {video_number}: {video_url}\n"
+            f"Error ({kind}): {str(e)}\n\n"
+        )
         
-        return False
+        # Permanent errors (e.g. 404) are not retried at the end of the batch
+        return None if kind == 'permanent' else False
+    finally:
+        progress_dashboard.finish(video_url)
 
-def print_progress(d, video_number):
-    """Print download progress"""
-    if d['status'] == 'downloading':
-        percent = d.get('_percent_str', '0%').strip()
-        speed = d.get('_speed_str', 'N/A')
-        eta = d.get('_eta_str', 'N/A')
-        
-        print(f"\r🎬 Video {video_number}: {percent} | Speed: {speed} | ETA: {eta}", end='', flush=True)
-    elif d['status'] == 'finished':
-        print(f"\r🎬 Video {video_number}: Download completed!{' ' * 50}")
+class _DashboardStdout:
+    """stdout wrapper that clears the dashboard before other output is written"""
+    def __init__(self, dashboard, stream):
+        self.dashboard = dashboard
+        self.stream = stream
+
+    def write(self, text):
+        with self.dashboard.lock:
+            self.dashboard._clear()
+            if text:
+                self.dashboard.at_line_start = text.endswith('\n')
+            return self.stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class ProgressDashboard:
+    """
+    Progress of all active downloads. Hooks only update shared counters;
+    a renderer thread redraws per-video bars with the aggregate MB/s and
+    ETA at a fixed rate, or logs plain lines when stdout is not a terminal.
+    """
+    def __init__(self, refresh=PROGRESS_REFRESH_SECONDS, log_interval=PROGRESS_LOG_SECONDS,
+                 max_rows=PROGRESS_MAX_ROWS):
+        self.lock = threading.Lock()
+        self.refresh = refresh
+        self.log_interval = log_interval
+        self.max_rows = max_rows
+        self.videos = {}            # key -> {'label', 'files': {filename: (done, total)}, 'speed'}
+        self.planned = {}           # key -> expected bytes of selected videos not finished yet
+        self.finished = 0
+        self.hook_calls = 0
+        self.hook_seconds = 0.0
+        self.sessions = 0
+        self.paused_count = 0
+        self.stream = None
+        self.tty = False
+        self.drawn_lines = 0
+        self.at_line_start = True
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def hook(self, key, label, d):
+        """Record a progress event; called for every hook callback, so it only updates counters"""
+        started = time.perf_counter()
+        status = d['status']
+        with self.lock:
+            video = self.videos.get(key)
+            if video is None:
+                video = self.videos[key] = {'label': label, 'files': {}, 'speed': None}
+            if status in ('downloading', 'finished'):
+                total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+                done = d.get('downloaded_bytes') or (total if status == 'finished' else 0)
+                video['files'][d.get('filename')] = (done, total)
+                video['speed'] = d.get('speed') if status == 'downloading' else None
+            self.hook_calls += 1
+            self.hook_seconds += time.perf_counter() - started
+
+    def plan(self, key, num_bytes):
+        """Expected size of a selected video, counted in the ETA until it finishes"""
+        with self.lock:
+            self.planned[key] = num_bytes
 
-def download_playlist_with_quality_selection(video_links, download_path):
+    def finish(self, key):
+        """Remove a video once its download returned (done, failed or skipped)"""
+        with self.lock:
+            self.planned.pop(key, None)
+            if self.videos.pop(key, None) is not None:
+                self.finished += 1
+
+    def hook_overhead_us(self):
+        """Average time spent in hook() in microseconds"""
+        return self.hook_seconds / self.hook_calls * 1e6 if self.hook_calls else 0.0
+
+    @contextmanager
+    def session(self):
+        """Render while the block runs; nested and concurrent sessions share one renderer"""
+        with self.lock:
+            self.sessions += 1
+            if self.sessions == 1:
+                self.stream = sys.stdout
+                self.tty = hasattr(self.stream, 'isatty') and self.stream.isatty()
+                if self.tty:
+                    sys.stdout = _DashboardStdout(self, self.stream)
+                self.stop_event.clear()
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.sessions -= 1
+                last = self.sessions == 0
+            if last:
+                self.stop_event.set()
+                self.thread.join()
+                with self.lock:
+                    self._clear()
+                    if self.tty and isinstance(sys.stdout, _DashboardStdout):
+                        sys.stdout = self.stream
+
+    @contextmanager
+    def paused(self):
+        """Stop redrawing while the user is prompted"""
+        with self.lock:
+            self.paused_count += 1
+            self._clear()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.paused_count -= 1
+
+    def _run(self):
+        last_log = time.monotonic()
+        while not self.stop_event.wait(self.refresh):
+            if self.tty:
+                self._draw()
+            elif time.monotonic() - last_log >= self.log_interval:
+                last_log = time.monotonic()
+                self._log()
+
+    def _snapshot(self):
+        """Rows (label, done, total, speed), aggregate speed and remaining bytes; lock held"""
+        rows = []
+        remaining = 0
+        for key, video in self.videos.items():
+            done = sum(file_done for file_done, _ in video['files'].values())
+            total = sum(file_total for _, file_total in video['files'].values())
+            if not all(file_total for _, file_total in video['files'].values()):
+                total = max(total, self.planned.get(key, 0))
+            rows.append((video['label'], done, total, video['speed'] or 0))
+            remaining += max(0, total - done)
+        remaining += sum(num_bytes for key, num_bytes in self.planned.items() if key not in self.videos)
+        speed = sum(row[3] for row in rows)
+        return rows, speed, remaining
+
+    def _summary_line(self, rows, speed, remaining):
+        eta = "N/A"
+        if speed > 0 and remaining:
+            seconds = int(remaining / speed)
+            eta = f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+        return (f"📶 {len(rows)} downloading, {self.finished} finished | "
+                f"{speed / (1024 * 1024):.2f} MB/s | {remaining / (1024 * 1024):.1f} MB left | ETA {eta}")
+
+    @staticmethod
+    def _row(label, done, total, speed, bar_width=20):
+        done_mb = done / (1024 * 1024)
+        if total:
+            filled = min(bar_width, int(bar_width * done / total))
+            return (f"   {label:<10} [{'#' * filled}{'-' * (bar_width - filled)}] {done * 100 / total:5.1f}% "
+                    f"{done_mb:.1f}/{total / (1024 * 1024):.1f} MB {speed / (1024 * 1024):.2f} MB/s")
+        return f"   {label:<10} {done_mb:.1f} MB {speed / (1024 * 1024):.2f} MB/s"
+
+    def _clear(self):
+        """Erase the drawn block; lock held"""
+        if self.drawn_lines:
+            self.stream.write(f"\x1b[{self.drawn_lines}F\x1b[J")
+            self.drawn_lines = 0
+
+    def _draw(self):
+        with self.lock:
+            if self.paused_count or not self.at_line_start:
+                return      # A prompt or a partly written line is on screen
+            rows, speed, remaining = self._snapshot()
+            lines = [self._summary_line(rows, speed, remaining)] if rows or self.planned else []
+            lines += [self._row(*row) for row in rows[:self.max_rows]]
+            if len(rows) > self.max_rows:
+                lines.append(f"   ... and {len(rows) - self.max_rows} more")
+            width = shutil.get_terminal_size().columns - 2
+            self._clear()
+            if lines:
+                self.stream.write("".join(line[:width] + "\n" for line in lines))
+                self.stream.flush()
+                self.drawn_lines = len(lines)
+
+    def _log(self):
+        with self.lock:
+            rows, speed, remaining = self._snapshot()
+            if not rows:
+                return
+            lines = [f"[{datetime.now().strftime('%H:%M:%S')}] " + self._summary_line(rows, speed, remaining)]
+            lines += [self._row(*row) for row in rows]
+            self.stream.write("".join(line + "\n" for line in lines))
+            self.stream.flush()
+
+progress_dashboard = ProgressDashboard()
+
+def download_playlist_with_quality_selection(video_links, download_path,
+                                             max_workers=MAX_WORKERS, max_per_host=MAX_PER_HOST,
+                                             policy=None, playlist_url=None, store=None, selections=None):
     """
-    Download playlist with quality selection for each video
+    Download playlist with quality selection for each video.
+    video_links may be a list or a lazy iterator of links. The stages
+    (discover, probe, select, download, record) are connected by bounded
+    queues, so the first download starts as soon as the first link is
+    found and memory does not grow with the playlist.
+    Formats are chosen in order (by the user, or automatically when a
+    selection policy is given); downloads run in a bounded worker pool.
+    A rerun for the same playlist_url continues in the same folder and
+    skips videos the job journal marks as done.
+    In batch mode, store is a ContentStore and selections maps video ids
+    to formats already chosen in earlier playlists, so those videos are
+    linked without probing or prompting again.
     """
-    if not video_links:
+    total_videos = len(video_links) if isinstance(video_links, (list, tuple)) else '?'
+    video_links = iter(video_links)
+    first_link = next(video_links, None)
+    if first_link is None:
         print("❌ No videos found to download.")
-        return
-    
-    total_videos = len(video_links)
+        return None
+    video_links = itertools.chain([first_link], video_links)
     
     # Statistics
     stats = {
-        'total': total_videos,
+        'total': 0,
         'downloaded': 0,
         'failed': 0,
         'skipped': 0,
+        'already_done': 0,
+        'linked': 0,
         'total_size_mb': 0,
+        'planned_size_mb': 0,
+        'planned_estimated': 0,
         'start_time': datetime.now(),
-        'selected_formats': []
+        'quality_counts': {}
     }
     
-    print(f"\n🎬 Starting download of {total_videos} videos...")
+    print(f"\n🎬 Starting download of {total_videos if total_videos != '?' else 'all'} videos...")
     print("=" * 60)
     
-    # Create playlist folder with timestamp
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    playlist_folder = os.path.join(download_path, f"Playlist_{timestamp}")
+    # Reuse this playlist's folder from an earlier run, or create one with timestamp
+    playlist_folder = find_playlist_folder(download_path, playlist_url)
+    resuming = os.path.isdir(playlist_folder)
     os.makedirs(playlist_folder, exist_ok=True)
+    journal = JobJournal(playlist_folder, playlist_url)
+    if resuming:
+        print(f"♻️ Resuming previous run in: {playlist_folder}")
+    
+    if selections is None:
+        selections = {}
+    
+    def pending_videos():
+        # Discover stage: number links and skip videos completed in an earlier run
+        for index, video_url in enumerate(video_links, 1):
+            update_stats(stats, total=1)
+            if journal.is_done(video_url):
+                update_stats(stats, already_done=1)
+                continue
+            journal.record(video_url, 'queued', video_number=index)
+            yield index, video_url
     
-    # Process each video
-    for index, video_url in enumerate(video_links, 1):
-        print(f"\n\n📋 Processing video {index} of {total_videos}")
+    def probe_url(item):
+        # Videos chosen in an earlier playlist of the batch are linked from the store unprobed
+        _, video_url = item
+        known = selections.get(get_video_id(video_url))
+        if store and known and os.path.exists(store.path_for(get_video_id(video_url), known['format']['format_id'])):
+            return None
+        journal.record(video_url, 'probing')
+        return video_url
+    
+    # Progress of all running downloads is drawn by one renderer
+    with progress_dashboard.session():
+        scheduler = DownloadScheduler(max_workers, max_per_host)
+        prefetcher = FormatPrefetcher(pending_videos(), url_of=probe_url)
+        stage = iter(prefetcher)
+    
+        # Process each video
+        while True:
+            # Get available formats for the next video (probed in the background)
+            wait_start = time.perf_counter()
+            entry = next(stage, None)
+            if entry is None:
+                break
+            (index, video_url), formats_info = entry
+        
+            if formats_info is None:
+                known = selections[get_video_id(video_url)]
+                scheduler.submit(download_video_with_format, video_url, known['format'], playlist_folder,
+                                 index, total_videos, stats, known['video_info'], journal, store)
+                continue
         
-        # Get available formats for this video
-        formats_info = get_video_formats(video_url)
+            metrics.observe('probe_wait', time.perf_counter() - wait_start, video=index)
+            print(f"\n\n📋 Processing video {index} of {total_videos}")
         
-        # Let user select format
-        selected_format = display_and_select_format(formats_info, index, total_videos)
+            # Select format (automatically or by the user)
+            with metrics.phase('selection_wait', video=index, mode='policy' if policy else 'interactive'):
+                if policy is not None:
+                    selected_format = select_format_by_policy(formats_info['formats'], policy)
+                    if selected_format:
+                        print(f"🤖 Auto-selected for video {index}: {selected_format['quality']} "
+                              f"(ID: {selected_format['format_id']}) - {formats_info['title']}")
+                else:
+                    with progress_dashboard.paused():
+                        selected_format = display_and_select_format(formats_info, index, total_videos)
         
-        if selected_format is None:
-            print(f"⏭️ Skipping video {index}")
-            stats['skipped'] += 1
-            continue
+            if selected_format is None:
+                print(f"⏭️ Skipping video {index}")
+                update_stats(stats, skipped=1)
+                continue
         
-        # Download video with selected format
-        success = download_video_with_format(
-            video_url, 
-            selected_format, 
-            playlist_folder, 
-            index, 
-            total_videos,
-            stats
-        )
+            # Queue download with selected format (blocks while the download queue is full)
+            scheduler.submit(
+                download_video_with_format,
+                video_url, 
+                selected_format, 
+                playlist_folder, 
+                index, 
+                total_videos,
+                stats,
+                formats_info.get('info'),
+                journal,
+                store,
+                media_url=(find_raw_format(formats_info.get('info'), selected_format['format_id']) or {}).get('url')
+            )
         
-        # Save selected format info
-        stats['selected_formats'].append({
-            'video': index,
-            'url': video_url,
-            'quality': selected_format['quality'],
-            'format_id': selected_format['format_id']
-        })
+            if store and get_video_id(video_url):
+                selections[get_video_id(video_url)] = {
+                    'format': selected_format,
+                    'video_info': {'title': formats_info['title'],
+                                   'id': (formats_info.get('info') or {}).get('id') or get_video_id(video_url)}
+                }
         
-        # Delay between downloads
-        if index < total_videos and success:
-            print("\n⏳ Waiting before next video...")
-            time.sleep(3)
+            # Record selected quality (counts only, so stats stay small)
+            quality_counts = stats['quality_counts']
+            quality_counts[selected_format['quality']] = quality_counts.get(selected_format['quality'], 0) + 1
+            if isinstance(selected_format['filesize_mb'], (int, float)):
+                stats['planned_size_mb'] += selected_format['filesize_mb']
+                if selected_format.get('filesize_source') == 'estimated':
+                    stats['planned_estimated'] += 1
+                progress_dashboard.plan(video_url, selected_format['filesize_mb'] * 1024 * 1024)
+    
+        prefetcher.close()
+    
+        # Wait for queued downloads to finish, then give failed videos another pass
+        print("\n⏳ Waiting for remaining downloads to finish...")
+        for _ in range(REQUEUE_ROUNDS):
+            requeued = scheduler.requeue_failed()
+            if not requeued:
+                break
+            print(f"\n🔁 Retrying {requeued} failed videos at the end of the batch")
+            update_stats(stats, failed=-requeued)
+        scheduler.wait_all()
+    
+    # Batch mode drains once after its last playlist, so the next one starts downloading meanwhile
+    if store is None:
+        post_processor.drain()
     
     # Show summary
     show_download_summary(stats, playlist_folder)
+    metrics.write_prometheus()
+    
+    return stats
+
+def download_playlists_batch(playlist_urls, download_path, max_workers=MAX_WORKERS,
+                             max_per_host=MAX_PER_HOST, policy=None):
+    """
+    Download several playlists (or channels) that may share videos.
+    Each unique video and format is downloaded once into a shared store
+    and linked into every playlist folder that contains it.
+    """
+    store = ContentStore(os.path.join(download_path, STORE_DIR))
+    selections = {}
+    results = []
+    total = 0
+    unique = set()
+    
+    # Playlists are crawled concurrently; each one is downloaded as soon
+    # as it is fully enumerated while the rest are still being crawled
+    for playlist_url, video_links in crawl_playlists(playlist_urls):
+        total += len(video_links)
+        unique.update(get_video_id(url) or url for url in video_links)
+        print(f"\n▶️ Playlist: {playlist_url}")
+        stats = download_playlist_with_quality_selection(
+            video_links, download_path,
+            max_workers=max_workers, max_per_host=max_per_host,
+            policy=policy, playlist_url=playlist_url,
+            store=store, selections=selections
+        )
+        results.append(stats)
+    
+    post_processor.drain()
+    print(f"\n📦 {len(results)} playlists, {total} videos, {len(unique)} unique")
+    return results
+
+class WorkQueue:
+    """
+    SQLite job queue shared by a coordinator and workers on several
+    machines. Each job is leased to one worker; leases are renewed by
+    heartbeats, and a job whose lease runs out is handed out again.
+    """
+    def __init__(self, path, lease_seconds=QUEUE_LEASE_SECONDS, max_attempts=QUEUE_MAX_ATTEMPTS):
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def _connect(self):
+        if self.conn is None:
+            os.makedirs(self.root, exist_ok=True)
+            # Default rollback journal (not WAL), so locking also works on network file systems
+            self.conn = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            self.conn.row_factory = sqlite3.Row
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY,
+                    playlist_url TEXT NOT NULL,
+                    video_url TEXT NOT NULL,
+                    video_number INTEGER NOT NULL,
+                    total_videos INTEGER NOT NULL,
+                    folder TEXT NOT NULL,
+                    policy TEXT NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'queued',
+                    worker TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    updated REAL NOT NULL,
+                    UNIQUE (playlist_url, video_url)
+                )
+            """)
+        return self.conn
+
+    @contextmanager
+    def _transaction(self):
+        """Write transaction; BEGIN IMMEDIATE locks out other processes until commit"""
+        with self.lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def enqueue(self, playlist_url, video_links, folder, policy):
+        """Add the videos of a playlist; returns the number of new jobs"""
+        # Folders are stored relative to the queue, so workers may mount it elsewhere
+        folder = os.path.relpath(os.path.abspath(folder), self.root)
+        now = time.time()
+        rows = [(playlist_url, video_url, index, len(video_links), folder, json.dumps(policy), now)
+                for index, video_url in enumerate(video_links, 1)]
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany("""
+                INSERT OR IGNORE INTO jobs (playlist_url, video_url, video_number, total_videos,
+                                            folder, policy, updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            return conn.total_changes - before
+
+    def _requeue_expired(self, conn):
+        now = time.time()
+        conn.execute("""
+            UPDATE jobs SET state = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END,
+                            worker = NULL, error = 'lease expired', updated = ?
+            WHERE state = 'leased' AND lease_expires < ?
+        """, (self.max_attempts, now, now))
+
+    def requeue_expired(self):
+        """Hand jobs of dead workers back to the queue (or fail them after max attempts)"""
+        with self._transaction() as conn:
+            self._requeue_expired(conn)
+
+    def lease(self, worker):
+        """Claim the next queued job for worker; None if nothing is queued"""
+        with self._transaction() as conn:
+            self._requeue_expired(conn)
+            row = conn.execute("SELECT * FROM jobs WHERE state = 'queued' ORDER BY attempts, id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            conn.execute("""
+                UPDATE jobs SET state = 'leased', worker = ?, lease_expires = ?,
+                                attempts = attempts + 1, updated = ?
+                WHERE id = ?
+            """, (worker, now + self.lease_seconds, now, row['id']))
+        
+        job = dict(row)
+        job['folder'] = os.path.join(self.root, job['folder'])
+        job['policy'] = json.loads(job['policy'])
+        return job
+
+    def heartbeat(self, job_id, worker):
+        """Renew a lease; False if the worker no longer holds it"""
+        with self._transaction() as conn:
+            cursor = conn.execute("""
+                UPDATE jobs SET lease_expires = ?, updated = ?
+                WHERE id = ? AND worker = ? AND state = 'leased'
+            """, (time.time() + self.lease_seconds, time.time(), job_id, worker))
+            return cursor.rowcount == 1
+
+    def finish(self, job_id, worker, state, error=None, retry=True):
+        """
+        Record the result of a job; failed jobs are queued again until max attempts unless retry is False.
+        Returns False if the worker no longer holds the lease (the job was re-queued or taken over).
+        """
+        with self._transaction() as conn:
+            if state == 'failed' and retry:
+                cursor = conn.execute("""
+                    UPDATE jobs SET state = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END,
+                                    worker = NULL, error = ?, updated = ?
+                    WHERE id = ? AND worker = ? AND state = 'leased'
+                """, (self.max_attempts, error, time.time(), job_id, worker))
+            else:
+                cursor = conn.execute("""
+                    UPDATE jobs SET state = ?, worker = NULL, error = ?, updated = ?
+                    WHERE id = ? AND worker = ? AND state = 'leased'
+                """, (state, error, time.time(), job_id, worker))
+            return cursor.rowcount == 1
+
+    def counts(self):
+        """Number of jobs per state"""
+        with self.lock:
+            rows = self._connect().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return {state: count for state, count in rows}
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+def run_coordinator(playlist_urls, download_path, queue_path, policy, wait=True):
+    """
+    Coordinator mode: enumerate playlists into the shared queue, then
+    watch progress and re-queue jobs of dead workers until it drains
+    """
+    work_queue = WorkQueue(queue_path)
+    for playlist_url, video_links in crawl_playlists(playlist_urls):
+        folder = find_playlist_folder(download_path, playlist_url)
+        os.makedirs(folder, exist_ok=True)
+        JobJournal(folder, playlist_url)    # Header lets later runs find this folder
+        added = work_queue.enqueue(playlist_url, video_links, folder, policy)
+        print(f"📥 {playlist_url}: {len(video_links)} videos, {added} new jobs")
+    
+    counts = work_queue.counts()
+    while wait:
+        work_queue.requeue_expired()
+        counts = work_queue.counts()
+        print(f"📊 Queue: {counts.get('queued', 0)} queued | {counts.get('leased', 0)} running | "
+              f"{counts.get('done', 0)} done | {counts.get('skipped', 0)} skipped | {counts.get('failed', 0)} failed")
+        if not counts.get('queued') and not counts.get('leased'):
+            break
+        time.sleep(QUEUE_POLL_SECONDS)
+    
+    work_queue.close()
+    return 1 if counts.get('failed') else 0
+
+def run_worker(queue_path, max_workers=MAX_WORKERS, wait=False):
+    """
+    Worker mode: lease jobs from the shared queue and download them.
+    Stops when no job is queued or running anywhere, unless wait is set.
+    """
+    work_queue = WorkQueue(queue_path)
+    worker_name = f"{socket.gethostname()}:{os.getpid()}"
+    stats = {
+        'total': 0,
+        'downloaded': 0,
+        'failed': 0,
+        'skipped': 0,
+        'already_done': 0,
+        'linked': 0,
+        'total_size_mb': 0,
+        'start_time': datetime.now(),
+        'quality_counts': {}
+    }
+    held = {}           # job id -> lease holder
+    held_lock = threading.Lock()
+    stopped = threading.Event()
+    
+    def send_heartbeats():
+        while not stopped.wait(QUEUE_HEARTBEAT_SECONDS):
+            with held_lock:
+                leases = list(held.items())
+            for job_id, holder in leases:
+                try:
+                    if not work_queue.heartbeat(job_id, holder):
+                        print(f"⚠️ Lease on job {job_id} was lost")
+                except sqlite3.Error as e:
+                    print(f"⚠️ Heartbeat failed: {e}")
+    
+    def process(job):
+        formats_info = get_video_formats(job['video_url'])
+        if not formats_info['formats']:
+            return 'failed', "No formats found"
+        selected_format = select_format_by_policy(formats_info['formats'], job['policy'])
+        if selected_format is None:
+            return 'skipped', "No format matches the policy"
+        
+        os.makedirs(job['folder'], exist_ok=True)
+        success = download_video_with_format(job['video_url'], selected_format, job['folder'],
+                                             job['video_number'], job['total_videos'], stats,
+                                             formats_info.get('info'))
+        if success is None:
+            return 'permanent', "Permanent download error"
+        return ('done', None) if success else ('failed', "Download failed")
+    
+    def run_slot(slot):
+        holder = f"{worker_name}:{slot}"
+        while True:
+            job = work_queue.lease(holder)
+            if job is None:
+                counts = work_queue.counts()
+                if not wait and not counts.get('queued') and not counts.get('leased'):
+                    return
+                time.sleep(QUEUE_POLL_SECONDS)
+                continue
+            
+            update_stats(stats, total=1)
+            with held_lock:
+                held[job['id']] = holder
+            try:
+                state, error = process(job)
+            except Exception as e:
+                state, error = 'failed', str(e)[:500]
+            finally:
+                with held_lock:
+                    held.pop(job['id'], None)
+            if state == 'skipped':
+                update_stats(stats, skipped=1)
+            if state == 'permanent':
+                recorded = work_queue.finish(job['id'], holder, 'failed', error, retry=False)
+            else:
+                recorded = work_queue.finish(job['id'], holder, state, error)
+            if not recorded:
+                print(f"⚠️ Lease on job {job['id']} was lost, result not recorded")
+    
+    print(f"👷 Worker {worker_name} started with {max_workers} slots")
+    threading.Thread(target=send_heartbeats, daemon=True).start()
+    with progress_dashboard.session(), ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(run_slot, range(max_workers)))
+    post_processor.drain()
+    stopped.set()
+    work_queue.close()
+    
+    print(f"\n📊 Worker {worker_name}: {stats['downloaded']} downloaded, {stats['skipped']} skipped, "
+          f"{stats['failed']} failed, {stats['total_size_mb']:.2f} MB")
+    metrics.write_prometheus()
+    return 1 if stats['failed'] else 0
+
+def save_links(video_links, links_file, playlist_url):
+    """Record stage: write each link to the link list as it passes through"""
+    with open(links_file, 'w', encoding='utf-8') as f:
+        f.write(f"Playlist: {playlist_url}\n")
+        f.write(f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+        
+        count = 0
+        for count, link in enumerate(video_links, 1):
+            f.write(f"{count}. {link}\n")
+            f.flush()
+            yield link
+        
+        f.write(f"\nTotal links: {count}\n")
+    print(f"💾 Link list saved to '{links_file}'")
 
 def show_download_summary(stats, download_path):
     """Display download summary"""
@@ -647,13 +3756,23 @@ def show_download_summary(stats, download_path):
     print(f"• Successfully downloaded: {stats['downloaded']}")
     print(f"• Failed: {stats['failed']}")
     print(f"• Skipped: {stats['skipped']}")
+    print(f"• Already downloaded (earlier run): {stats['already_done']}")
+    if stats['linked']:
+        print(f"• Linked from store (not downloaded again): {stats['linked']}")
     print(f"• Total file size: {stats['total_size_mb']:.2f} MB")
+    if stats.get('planned_size_mb'):
+        print(f"• Planned size of selected formats: {stats['planned_size_mb']:.2f} MB"
+              f" ({stats['planned_estimated']} estimated)")
+    print(f"• Extractor calls: {run_counters['extractor_calls']}")
+    print(f"• Metadata cache: {run_counters['cache_hits']} hits, {run_counters['cache_misses']} misses")
+    print(f"• Progress hooks: {progress_dashboard.hook_calls} calls, "
+          f"{progress_dashboard.hook_overhead_us():.1f} µs each")
     print(f"• Total duration: {hours:02d}:{minutes:02d}:{seconds:02d}")
     print(f"• Save location: {download_path}")
     print("=" * 60)
     
     if stats['total'] > 0:
-        success_rate = (stats['downloaded'] / stats['total']) * 100
+        success_rate = ((stats['downloaded'] + stats['linked']) / stats['total']) * 100
         print(f"• Success rate: {success_rate:.1f}%")
     
     # Save summary
@@ -666,12 +3785,18 @@ def show_download_summary(stats, download_path):
         f.write(f"Downloaded: {stats['downloaded']}\n")
         f.write(f"Failed: {stats['failed']}\n")
         f.write(f"Skipped: {stats['skipped']}\n")
+        f.write(f"Already downloaded: {stats['already_done']}\n")
+        f.write(f"Linked from store: {stats['linked']}\n")
         f.write(f"Total size: {stats['total_size_mb']:.2f} MB\n")
+        if stats.get('planned_size_mb'):
+            f.write(f"Planned size: {stats['planned_size_mb']:.2f} MB ({stats['planned_estimated']} estimated)\n")
+        f.write(f"Extractor calls: {run_counters['extractor_calls']}\n")
+        f.write(f"Metadata cache: {run_counters['cache_hits']} hits, {run_counters['cache_misses']} misses\n")
         f.write(f"Duration: {hours:02d}:{minutes:02d}:{seconds:02d}\n\n")
         
         f.write("Selected Qualities:\n")
-        for fmt in stats['selected_formats']:
-            f.write(f"  Video {fmt['video']}: {fmt['quality']} (ID: {fmt['format_id']})\n")
+        for quality, count in sorted(stats['quality_counts'].items()):
+            f.write(f"  {quality}: {count} videos\n")
     
     print(f"\n💾 Summary saved to: {summary_file}")
     print("\n🎉 Download operation completed!")
@@ -738,8 +3863,275 @@ def check_dependencies():
     
     return all(dependencies.values())
 
-def main():
-    """Main function"""
+COMMANDS = ('interactive', 'list', 'probe', 'download', 'coordinator', 'worker', 'verify')
+
+def add_policy_arguments(parser):
+    """Quality policy options"""
+    policy_group = parser.add_argument_group("quality policy (applied automatically instead of prompting)")
+    policy_group.add_argument('--policy-file', help="JSON file with selection policy")
+    policy_group.add_argument('--max-height', type=int, help="Maximum video height, e.g. 720")
+    policy_group.add_argument('--min-height', type=int, help="Minimum video height, e.g. 360")
+    policy_group.add_argument('--prefer-ext', help="Preferred container, e.g. mp4")
+    policy_group.add_argument('--prefer-fps', choices=['high', 'low'], help="Prefer higher or lower frame rate")
+    policy_group.add_argument('--max-size-mb', type=float, help="Per-video size cap in MB")
+    policy_group.add_argument('--fallback', help=f"Comma separated fallback order ({', '.join(FALLBACK_STEPS)})")
+    policy_group.add_argument('--interactive', action='store_true',
+                              help="Ask for quality of each video even if a policy is given")
+
+def add_download_arguments(parser):
+    """Concurrency, bandwidth and metrics options"""
+    download_group = parser.add_argument_group("downloads")
+    download_group.add_argument('--workers', type=int, default=MAX_WORKERS, help="Total concurrent downloads")
+    download_group.add_argument('--per-host', type=int, default=MAX_PER_HOST, help="Concurrent downloads per media host")
+    
+    bandwidth_group = parser.add_argument_group("bandwidth")
+    bandwidth_group.add_argument('--limit-mbps', type=float, default=BANDWIDTH_LIMIT_MBPS,
+                                 help="Total download rate limit in MB/s")
+    bandwidth_group.add_argument('--per-video-limit-mbps', type=float, default=PER_VIDEO_LIMIT_MBPS,
+                                 help="Per-video rate limit in MB/s")
+    bandwidth_group.add_argument('--bandwidth-file', default=BANDWIDTH_CONTROL_FILE,
+                                 help="JSON file with limits and schedule, re-read while running "
+                                      f"(default: {BANDWIDTH_CONTROL_FILE})")
+    
+    postprocess_group = parser.add_argument_group("post-processing")
+    postprocess_group.add_argument('--postprocess', action='append', choices=list(POSTPROCESSORS), metavar='STEP',
+                                   help=f"Extra step after each download, repeatable ({', '.join(POSTPROCESSORS)}); "
+                                        f"{', '.join(POSTPROCESS_STEPS)} always runs")
+    postprocess_group.add_argument('--postprocess-workers', type=int, default=POSTPROCESS_WORKERS,
+                                   help="Post-processing processes (default: number of cores)")
+    
+    metrics_group = parser.add_argument_group("metrics")
+    metrics_group.add_argument('--metrics-jsonl', default=METRICS_EVENTS_FILE,
+                               help="Append per-phase timing events to this JSON-lines file")
+    metrics_group.add_argument('--metrics-prom', default=METRICS_PROM_FILE,
+                               help="Write phase histograms to this Prometheus textfile")
+
+def parse_arguments(argv=None):
+    """
+    Parse command line options.
+    Without a subcommand the interactive mode is used, so
+    'main.py --max-height 720' keeps working.
+    """
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or (argv[0] not in COMMANDS and argv[0] not in ('-h', '--help')):
+        argv = ['interactive'] + argv
+    
+    parser = argparse.ArgumentParser(description="Aparat playlist downloader with quality selection")
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    
+    interactive_parser = subparsers.add_parser('interactive', help="Prompt for URL, location and qualities (default)")
+    add_policy_arguments(interactive_parser)
+    add_download_arguments(interactive_parser)
+    
+    list_parser = subparsers.add_parser('list', help="Print the video links of playlists or channels")
+    list_parser.add_argument('urls', nargs='+', help="Playlist or channel URLs")
+    list_parser.add_argument('-o', '--output', help="Write links to this file instead of stdout")
+    list_parser.add_argument('--json', action='store_true', help="Print links as a JSON array")
+    
+    probe_parser = subparsers.add_parser('probe', help="Show available formats of videos or playlists")
+    probe_parser.add_argument('urls', nargs='+', help="Video or playlist URLs")
+    probe_parser.add_argument('--json', action='store_true', help="Print formats as JSON")
+    probe_parser.add_argument('--no-cache', action='store_true', help="Bypass the metadata cache")
+    
+    download_parser = subparsers.add_parser('download', help="Download playlists without prompts")
+    download_parser.add_argument('urls', nargs='*', help="Playlist or channel URLs (several share one media store)")
+    download_parser.add_argument('--from-file', help="Read playlist URLs from this file, one per line")
+    download_parser.add_argument('-o', '--output', default="Aparat_Downloads", help="Download folder")
+    download_parser.add_argument('--no-cache', action='store_true', help="Bypass the metadata cache")
+    add_policy_arguments(download_parser)
+    add_download_arguments(download_parser)
+    
+    coordinator_parser = subparsers.add_parser('coordinator', help="Queue playlists for workers on several machines")
+    coordinator_parser.add_argument('urls', nargs='*', help="Playlist or channel URLs")
+    coordinator_parser.add_argument('--from-file', help="Read playlist URLs from this file, one per line")
+    coordinator_parser.add_argument('-o', '--output', default="Aparat_Downloads", help="Download folder (shared storage)")
+    coordinator_parser.add_argument('--queue', help=f"Queue database (default: <output>/{QUEUE_FILE})")
+    coordinator_parser.add_argument('--no-wait', action='store_true', help="Exit after queueing instead of watching")
+    add_policy_arguments(coordinator_parser)
+    
+    worker_parser = subparsers.add_parser('worker', help="Download jobs from a coordinator's queue")
+    worker_parser.add_argument('--queue', required=True, help="Queue database on shared storage")
+    worker_parser.add_argument('--wait', action='store_true', help="Keep polling when the queue is empty")
+    worker_parser.add_argument('--no-cache', action='store_true', help="Bypass the metadata cache")
+    add_download_arguments(worker_parser)
+    
+    verify_parser = subparsers.add_parser('verify', help="Check downloaded files against their manifests")
+    verify_parser.add_argument('folder', nargs='?', default="Aparat_Downloads", help="Download folder")
+    verify_parser.add_argument('--deep', action='store_true', help="Re-hash every file instead of checking size and mtime")
+    
+    return parser.parse_args(argv)
+
+def build_policy_from_args(args):
+    """Return selection policy from arguments, or None for interactive mode"""
+    overrides = {
+        'max_height': args.max_height,
+        'min_height': args.min_height,
+        'prefer_ext': args.prefer_ext,
+        'prefer_fps': args.prefer_fps,
+        'max_size_mb': args.max_size_mb,
+        'fallback': [step.strip() for step in args.fallback.split(',')] if args.fallback else None
+    }
+    if args.interactive or (not args.policy_file and all(v is None for v in overrides.values())):
+        return None
+    return load_quality_policy(args.policy_file, overrides)
+
+def apply_download_arguments(args):
+    """Configure bandwidth limiter, post-processing and metrics from arguments"""
+    bandwidth_limiter.control_file = args.bandwidth_file
+    bandwidth_limiter.set_limits(args.limit_mbps, args.per_video_limit_mbps, BANDWIDTH_SCHEDULE)
+    extra_steps = [step for step in args.postprocess or [] if step not in POSTPROCESS_STEPS]
+    post_processor.configure(POSTPROCESS_STEPS + extra_steps, args.postprocess_workers)
+    metrics.configure(args.metrics_jsonl, args.metrics_prom)
+
+def collect_video_links(urls):
+    """Expand playlist and channel URLs into video links (video URLs are kept as-is)"""
+    video_links = {}
+    for _, links in crawl_playlists(urls):
+        video_links.update(dict.fromkeys(links))
+    return list(video_links)
+
+def command_list(args):
+    """list: print video links, one per line, as they are found"""
+    stdout = sys.stdout
+    streaming = not args.json and not args.output
+    video_links = {}
+    
+    # Progress messages go to stderr so stdout stays machine-readable
+    with redirect_stdout(sys.stderr):
+        for _, video_url in PlaylistCrawler().stream(args.urls):
+            if video_url and video_url not in video_links:
+                video_links[video_url] = None
+                if streaming:
+                    print(video_url, file=stdout, flush=True)
+    video_links = list(video_links)
+    
+    if streaming:
+        return 0 if video_links else 1
+    
+    text = json.dumps(video_links, indent=2) if args.json else "\n".join(video_links)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+        print(f"💾 {len(video_links)} links saved to '{args.output}'", file=sys.stderr)
+    else:
+        print(text)
+    return 0 if video_links else 1
+
+def command_probe(args):
+    """probe: show formats for each video"""
+    with redirect_stdout(sys.stderr):
+        video_links = collect_video_links(args.urls)
+    
+    results = []
+    total_mb = 0
+    estimated = 0
+    prefetcher = FormatPrefetcher(video_links)
+    try:
+        for video_url, formats_info in prefetcher:
+            # Planning total: the best format of each video
+            if formats_info['formats'] and isinstance(formats_info['formats'][0]['filesize_mb'], (int, float)):
+                total_mb += formats_info['formats'][0]['filesize_mb']
+                estimated += formats_info['formats'][0].get('filesize_source') == 'estimated'
+            if args.json:
+                results.append({key: formats_info[key] for key in ('webpage_url', 'title', 'formats')})
+            else:
+                print(f"\n📹 {formats_info['title']}")
+                print(f"🔗 {video_url}")
+                print_formats_table(formats_info['formats'])
+    finally:
+        prefetcher.close()
+    
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+    else:
+        print(f"\n📦 Total size at best quality: {total_mb:.1f} MB ({estimated} estimated)")
+    return 0 if video_links else 1
+
+def read_playlist_urls(args):
+    """Playlist URLs from the command line and --from-file"""
+    playlist_urls = list(args.urls)
+    if args.from_file:
+        with open(args.from_file, encoding='utf-8') as f:
+            playlist_urls += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    return playlist_urls
+
+def command_download(args):
+    """download: download playlists with a quality policy and no prompts"""
+    # Without policy options the default policy (best quality) is used
+    policy = build_policy_from_args(args)
+    if policy is None and not args.interactive:
+        policy = load_quality_policy()
+    apply_download_arguments(args)
+    
+    playlist_urls = read_playlist_urls(args)
+    if not playlist_urls:
+        print("❌ No playlist URLs given.")
+        return 1
+    
+    os.makedirs(args.output, exist_ok=True)
+    if len(playlist_urls) > 1 or not get_playlist_id(playlist_urls[0]):
+        # Batch mode (several playlists or a channel): overlapping videos are downloaded once
+        results = download_playlists_batch(
+            playlist_urls, args.output,
+            max_workers=args.workers, max_per_host=args.per_host, policy=policy
+        )
+        return 1 if any(stats is None or stats['failed'] for stats in results) else 0
+    
+    stats = download_playlist_with_quality_selection(
+        iter_playlist_videos(playlist_urls[0]), args.output,
+        max_workers=args.workers, max_per_host=args.per_host,
+        policy=policy, playlist_url=playlist_urls[0]
+    )
+    return 1 if stats is None or stats['failed'] else 0
+
+def command_coordinator(args):
+    """coordinator: queue playlist videos for worker processes"""
+    # Workers cannot prompt, so the default policy is used without policy options
+    policy = build_policy_from_args(args) or load_quality_policy()
+    playlist_urls = read_playlist_urls(args)
+    if not playlist_urls:
+        print("❌ No playlist URLs given.")
+        return 1
+    
+    os.makedirs(args.output, exist_ok=True)
+    queue_path = args.queue or os.path.join(args.output, QUEUE_FILE)
+    return run_coordinator(playlist_urls, args.output, queue_path, policy, wait=not args.no_wait)
+
+def command_worker(args):
+    """worker: download jobs from the shared queue"""
+    apply_download_arguments(args)
+    if not os.path.exists(args.queue):
+        print(f"❌ Queue not found: {args.queue}")
+        return 1
+    return run_worker(args.queue, max_workers=args.workers, wait=args.wait)
+
+def command_verify(args):
+    """verify: confirm files from the manifests (stat only unless --deep)"""
+    checked = 0
+    problems = 0
+    for folder, _, files in os.walk(args.folder):
+        manifest = Manifest(folder)
+        names = set(manifest.entries) | {name for name in files if name.endswith('.mp4')}
+        for name in sorted(names):
+            status = manifest.check(os.path.join(folder, name), deep=args.deep)
+            checked += 1
+            if status != 'ok':
+                problems += 1
+                print(f"❌ {status}: {os.path.join(folder, name)}")
+    
+    print(f"{'✅' if not problems else '⚠️'} {checked} files checked, {problems} problems")
+    return 1 if problems else 0
+
+def run_interactive(args):
+    """Interactive mode: prompt for URL, location and qualities"""
+    try:
+        policy = build_policy_from_args(args)
+    except (OSError, ValueError) as e:
+        print(f"❌ Invalid quality policy: {e}")
+        sys.exit(1)
+    
+    apply_download_arguments(args)
+    
     clear_screen()
     display_banner()
     
@@ -763,54 +4155,27 @@ def main():
             continue
         
         # Validate URL
-        if 'aparat.com' not in playlist_url:
+        if APARAT_DOMAIN not in playlist_url:
             print("⚠️ The entered URL is not from Aparat.")
-            print("   URL must contain 'aparat.com'")
+            print(f"   URL must contain '{APARAT_DOMAIN}'")
             continue
         
         break
     
-    # Extract links from playlist page
-    print("\n" + "=" * 60)
-    print("🌐 Loading playlist page...")
-    
-    video_links = extract_video_links_from_page(playlist_url)
-    
-    if not video_links:
-        print("\n❌ No video links found on the page.")
-        print("   Possible reasons:")
-        print("   1. Playlist is private")
-        print("   2. Login required")
-        print("   3. Page structure changed")
-        print("   4. Page loads with JavaScript and requires Selenium")
-        sys.exit(1)
-    
-    # Display information
-    print(f"\n📋 Playlist Information:")
-    print(f"   Links found: {len(video_links)}")
-    
-    # Save link list
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    links_file = f"video_links_{timestamp}.txt"
-    
-    with open(links_file, 'w', encoding='utf-8') as f:
-        f.write(f"Playlist: {playlist_url}\n")
-        f.write(f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write(f"Total links: {len(video_links)}\n\n")
-        
-        for i, link in enumerate(video_links, 1):
-            f.write(f"{i}. {link}\n")
-    
-    print(f"💾 Link list saved to '{links_file}'")
-    
     # Get download path
     download_path = get_download_path()
     
-    # Final confirmation
+    # Final confirmation (links are discovered while downloading)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    links_file = f"video_links_{timestamp}.txt"
     print(f"\n⚠️ Final confirmation:")
-    print(f"   Total videos: {len(video_links)}")
+    print(f"   Playlist: {playlist_url}")
     print(f"   Save location: {download_path}")
-    print(f"\n📝 Note: You will be asked to select quality for EACH video individually.")
+    print(f"   Link list: {links_file}")
+    if policy is None:
+        print(f"\n📝 Note: You will be asked to select quality for EACH video individually.")
+    else:
+        print(f"\n📝 Quality policy: {describe_policy(policy)}")
     
     confirm = input("\n❓ Start download? (y/n): ").strip().lower()
     
@@ -818,8 +4183,48 @@ def main():
         print("❌ Operation cancelled.")
         sys.exit(0)
     
-    # Start download with quality selection
-    download_playlist_with_quality_selection(video_links, download_path)
+    # Start download with quality selection while the playlist is still being read
+    print("\n" + "=" * 60)
+    print("🌐 Loading playlist page...")
+    
+    video_links = save_links(iter_playlist_videos(playlist_url), links_file, playlist_url)
+    stats = download_playlist_with_quality_selection(video_links, download_path,
+                                                     max_workers=args.workers, max_per_host=args.per_host,
+                                                     policy=policy, playlist_url=playlist_url)
+    if stats is None:
+        print("\n❌ No video links found on the page.")
+        print("   Possible reasons:")
+        print("   1. Playlist is private")
+        print("   2. Login required")
+        print("   3. Page structure changed")
+        print("   4. Page loads with JavaScript and requires Selenium")
+        sys.exit(1)
+    return 0
+
+def main(argv=None):
+    """Main function"""
+    args = parse_arguments(argv)
+    
+    if getattr(args, 'no_cache', False):
+        global CACHE_ENABLED
+        CACHE_ENABLED = False
+    
+    commands = {
+        'interactive': run_interactive,
+        'list': command_list,
+        'probe': command_probe,
+        'download': command_download,
+        'coordinator': command_coordinator,
+        'worker': command_worker,
+        'verify': command_verify,
+    }
+    try:
+        return commands[args.command](args)
+    except (OSError, ValueError) as e:
+        if args.command == 'interactive':
+            raise
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
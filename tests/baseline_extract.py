@@ -0,0 +1,58 @@
+"""
+Link extractor from before the single-pass rewrite (BeautifulSoup tree),
+kept as the reference for the parity tests. Printing was removed;
+the logic is unchanged.
+"""
+import re
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+
+def extract_links_from_html(html_content, base_url):
+    """Extract video links from HTML"""
+    soup = BeautifulSoup(html_content, 'html.parser')
+    video_links = []
+    
+    # Search in all <a> tags
+    for link in soup.find_all('a', href=True):
+        href = link['href']
+        
+        # Convert relative links to absolute
+        if href.startswith('/'):
+            href = urljoin(base_url, href)
+        
+        # Check if link is a video
+        if '/v/' in href and 'aparat.com' in href:
+            # Clean the link
+            href = href.split('?')[0]  # Remove query parameters
+            video_links.append(href)
+    
+    # Search in iframe src attributes
+    for iframe in soup.find_all('iframe', src=True):
+        src = iframe['src']
+        if 'aparat.com' in src and '/v/' in src:
+            if src.startswith('/'):
+                src = urljoin(base_url, src)
+            src = src.split('?')[0]
+            video_links.append(src)
+    
+    # Search in scripts
+    for script in soup.find_all('script'):
+        if script.string:
+            script_text = script.string
+            # Find video IDs
+            video_ids = re.findall(r'/v/([a-zA-Z0-9_\-]+)', script_text)
+            for video_id in video_ids:
+                video_link = f"https://www.aparat.com/v/{video_id}"
+                video_links.append(video_link)
+    
+    # Remove duplicate links
+    unique_links = []
+    seen = set()
+    for link in video_links:
+        if link not in seen:
+            unique_links.append(link)
+            seen.add(link)
+    
+    return unique_links
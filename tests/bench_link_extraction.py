@@ -0,0 +1,49 @@
+"""
+Time the single-pass link extractor against the BeautifulSoup baseline
+on the saved large fixture.
+
+    python tests/bench_link_extraction.py [--runs 5] [--fixture PATH]
+"""
+import argparse
+import os
+import time
+
+from conftest import FIXTURES     # Also puts the repository root on sys.path
+
+import main
+from baseline_extract import extract_links_from_html as baseline_extract
+
+BASE_URL = 'https://www.aparat.com/playlist/1'
+
+
+def best_time(func, html_content, runs):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        links = func(html_content)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, links
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Link extraction benchmark")
+    parser.add_argument('--runs', type=int, default=5, help="Runs per extractor (best is reported)")
+    parser.add_argument('--fixture', default=os.path.join(FIXTURES, 'playlist_large.html'), help="HTML file")
+    args = parser.parse_args()
+    
+    with open(args.fixture, encoding='utf-8') as f:
+        html_content = f.read()
+    
+    old_time, old_links = best_time(lambda text: baseline_extract(text, BASE_URL), html_content, args.runs)
+    new_time, new_links = best_time(lambda text: list(main.iter_links_from_html(text, BASE_URL)),
+                                    html_content, args.runs)
+    
+    print(f"Fixture: {args.fixture} ({len(html_content) // 1024} KB, {len(new_links)} links)")
+    print(f"BeautifulSoup: {old_time * 1000:.1f} ms")
+    print(f"Single pass:   {new_time * 1000:.1f} ms ({old_time / new_time:.1f}x faster)")
+    print(f"Same links:    {old_links == new_links}")
+
+
+if __name__ == '__main__':
+    main_bench()
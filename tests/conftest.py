@@ -0,0 +1,51 @@
+import os
+import sys
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# FakeAparatServer settings for tests (small, fast, no random failures)
+SERVER_CONFIG = {
+    'videos': 3,
+    'latency': 0,
+    'bandwidth_bytes': None,
+    'failure_rate': 0,
+    'video_size_mb': 1,
+    'hls': False,
+    'hls_segments': 8,
+    'api': True,
+    'api_page_size': 2,
+    'seed': 1,
+}
+
+
+@pytest.fixture
+def fake_server(monkeypatch):
+    """Start a FakeAparatServer (benchmark.py) and point main.py at it"""
+    import benchmark
+    import main
+    
+    servers = []
+    
+    def start(**overrides):
+        server = benchmark.FakeAparatServer({**SERVER_CONFIG, **overrides})
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        monkeypatch.setattr(main, 'APARAT_DOMAIN', '127.0.0.1')
+        monkeypatch.setattr(main, 'APARAT_BASE_URL', server.base_url)
+        monkeypatch.setattr(main, 'APARAT_API_BASE', f"{server.base_url}/api/fa/v1")
+        monkeypatch.setattr(main, 'SELENIUM_AVAILABLE', False)
+        monkeypatch.setattr(main, 'CACHE_ENABLED', False)
+        # Fresh circuit state and short backoff so injected faults retry quickly
+        monkeypatch.setattr(main, 'retry_controller', main.RetryController(base_delay=0.01))
+        return server
+    
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,38 @@
+"""
+Regenerate fixtures/playlist_large.html, a large playlist-like page with
+video cards, inline scripts, embeds, comments and unrelated links.
+
+    python tests/make_fixture.py
+"""
+import os
+import random
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'playlist_large.html')
+
+
+def build_page(items=8000, seed=1):
+    rng = random.Random(seed)
+    parts = []
+    for i in range(items):
+        r = rng.random()
+        video_id = ''.join(rng.choice('abcdefXYZ0123_-') for _ in range(6))
+        if r < .5:
+            parts.append(f'<div class="card"><a class="title" href="/v/{video_id}?playlist=1" '
+                         f'title="Video &amp; {i}"><img src="/thumb/{i}.jpg" alt=\'a > b\'></a></div>\n')
+        elif r < .6:
+            parts.append(f'<script>window.data={{"url":"/v/{video_id}","n":{i}}};</script>\n')
+        elif r < .65:
+            parts.append(f'<iframe src="https://www.aparat.com/v/{video_id}?embed=1"></iframe>\n')
+        elif r < .7:
+            parts.append(f'<!-- <a href="/v/c{video_id}"> -->\n')
+        elif r < .72:
+            parts.append(f'<style>.c{i} a[href="/v/{video_id}"] {{ color: red }}</style>\n')
+        else:
+            parts.append(f'<a href="/user/{video_id}">user</a><span>text {i}</span>\n')
+    return '<!DOCTYPE html>\n<html><head><title>Playlist</title></head><body>\n' + ''.join(parts) + '</body></html>\n'
+
+
+if __name__ == '__main__':
+    with open(FIXTURE, 'w', encoding='utf-8') as f:
+        f.write(build_page())
+    print(f"Wrote {FIXTURE} ({os.path.getsize(FIXTURE) // 1024} KB)")
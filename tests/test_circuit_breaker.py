@@ -0,0 +1,35 @@
+"""Per-host circuit breaker for media transfers"""
+import time
+from urllib.parse import urlparse
+
+import main
+
+MEDIA_PATH = '/media/bench0000_720.mp4'
+
+
+def video_info(media_url):
+    return {
+        'id': 'bench0000',
+        'title': 'Video bench0000',
+        'formats': [{'format_id': '720', 'url': media_url, 'ext': 'mp4', 'protocol': 'http',
+                     'vcodec': 'avc1', 'acodec': 'mp4a', 'height': 720}],
+    }
+
+
+def test_throttled_media_host_opens_its_circuit(fake_server, tmp_path, monkeypatch):
+    server = fake_server()
+    # The media host differs from the page host, like a CDN
+    media_url = f"http://localhost:{server.server_port}{MEDIA_PATH}"
+    video_url = f"{server.base_url}/v/bench0000"
+    server.faults[MEDIA_PATH] = ['throttled'] * 20
+    monkeypatch.setattr(main, 'SEGMENTED_DOWNLOADS', False)     # Transfer through yt-dlp
+    stats = {'downloaded': 0, 'failed': 0, 'total_size_mb': 0}
+    
+    result = main.download_video_with_format(video_url, {'format_id': '720', 'quality': '720p'}, str(tmp_path),
+                                             1, 1, stats, video_info(media_url))
+    
+    assert result is False
+    assert stats['failed'] == 1
+    open_until = main.retry_controller.open_until
+    assert open_until.get(urlparse(media_url).netloc, 0) > time.monotonic() + 20
+    assert open_until.get(urlparse(video_url).netloc, 0) < time.monotonic()
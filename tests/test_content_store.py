@@ -0,0 +1,35 @@
+"""Videos already in the content store are linked, not downloaded again"""
+import os
+
+import main
+
+
+def video_info(server, video_id='bench0000'):
+    return {
+        'id': video_id,
+        'title': f"Video {video_id}",
+        'formats': [{'format_id': '720', 'url': f"{server.base_url}/media/{video_id}_720.mp4", 'ext': 'mp4',
+                     'protocol': 'http', 'vcodec': 'avc1', 'acodec': 'mp4a', 'height': 720}],
+    }
+
+
+def test_linked_video_is_not_counted_as_downloaded(fake_server, tmp_path, monkeypatch):
+    server = fake_server()
+    monkeypatch.setattr(main.post_processor, 'steps', [])
+    store = main.ContentStore(str(tmp_path / '.store'))
+    video_url = f"{server.base_url}/v/bench0000"
+    stats = {'downloaded': 0, 'failed': 0, 'linked': 0, 'total_size_mb': 0}
+    selected_format = {'format_id': '720', 'quality': '720p'}
+    
+    media_requests = []
+    for playlist in ('first', 'second'):
+        folder = tmp_path / playlist
+        folder.mkdir()
+        assert main.download_video_with_format(video_url, selected_format, str(folder), 1, 1, stats,
+                                               video_info(server), store=store)
+        media_requests.append(sum(path.startswith('/media/') for path in server.request_paths))
+    
+    size_mb = os.path.getsize(store.path_for('bench0000', '720')) / (1024 * 1024)
+    assert stats == {'downloaded': 1, 'failed': 0, 'linked': 1, 'total_size_mb': size_mb}
+    assert media_requests[0] > 0 and media_requests[1] == media_requests[0]
+    assert (tmp_path / 'second' / '001_bench0000_Video bench0000.mp4').exists()
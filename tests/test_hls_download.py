@@ -0,0 +1,87 @@
+"""Parallel HLS fragment download against a synthetic m3u8"""
+import pytest
+
+import main
+
+SEGMENTS = 8
+
+
+def expected_stream(server, video_id='bench0000'):
+    """init.mp4 followed by every fragment in playlist order"""
+    data = server.media_bytes(f"{video_id}_hls.mp4")
+    size = len(data) // SEGMENTS
+    return b'\x00\x00\x00\x18ftypisom' + data[:size * SEGMENTS]
+
+
+def playlist_url(server, video_id='bench0000'):
+    return f"{server.base_url}/hls/{video_id}/index.m3u8"
+
+
+def test_fragments_written_in_order(fake_server, tmp_path):
+    server = fake_server(hls=True, hls_segments=SEGMENTS)
+    # A slow early fragment makes later ones complete first
+    server.faults['/hls/bench0000/seg1.m4s'] = ['slow']
+    target = tmp_path / 'video.mp4'
+    digest = main.download_hls(playlist_url(server), str(target), workers=4)
+    
+    assert target.read_bytes() == expected_stream(server)
+    assert digest.hexdigest() == main.digest_file(str(target)).hexdigest()
+
+
+def test_failed_fragment_is_retried(fake_server, tmp_path):
+    server = fake_server(hls=True, hls_segments=SEGMENTS)
+    server.faults['/hls/bench0000/seg2.m4s'] = ['error']
+    server.faults['/hls/bench0000/seg5.m4s'] = ['truncate']
+    target = tmp_path / 'video.mp4'
+    main.download_hls(playlist_url(server), str(target), workers=4)
+    
+    assert target.read_bytes() == expected_stream(server)
+    assert server.request_paths.count('/hls/bench0000/seg2.m4s') == 2
+    assert server.request_paths.count('/hls/bench0000/seg5.m4s') == 2
+
+
+def test_buffered_fragments_stay_within_budget(fake_server, tmp_path, monkeypatch):
+    # 3 MB fragments, larger than the initial 1 MB size estimate
+    server = fake_server(hls=True, hls_segments=SEGMENTS, video_size_mb=3 * SEGMENTS)
+    # A slow init segment makes every fragment after it wait in the buffer
+    server.faults['/hls/bench0000/init.mp4'] = ['slow']
+    buffers = []
+    
+    class RecordingBuffer(main.FragmentBuffer):
+        def __init__(self, *args):
+            super().__init__(*args)
+            buffers.append(self)
+    
+    monkeypatch.setattr(main, 'FragmentBuffer', RecordingBuffer)
+    target = tmp_path / 'video.mp4'
+    main.download_hls(playlist_url(server), str(target), workers=6, max_buffer_mb=8)
+    
+    assert target.read_bytes() == expected_stream(server)
+    assert 0 < buffers[0].peak <= 8 * 1024 * 1024
+    assert buffers[0].buffered == 0
+
+
+def test_interrupted_download_resumes(fake_server, tmp_path, monkeypatch):
+    server = fake_server(hls=True, hls_segments=SEGMENTS)
+    target = tmp_path / 'video.mp4'
+    fetch_fragment = main._fetch_fragment
+    fetched = []
+    
+    def interrupted(url, *args):
+        if len(fetched) == 4:
+            raise KeyboardInterrupt
+        fetched.append(url)
+        return fetch_fragment(url, *args)
+    
+    monkeypatch.setattr(main, '_fetch_fragment', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        main.download_hls(playlist_url(server), str(target), workers=1)
+    monkeypatch.setattr(main, '_fetch_fragment', fetch_fragment)
+    
+    server.request_paths.clear()
+    main.download_hls(playlist_url(server), str(target), workers=2)
+    
+    assert target.read_bytes() == expected_stream(server)
+    # init.mp4 and seg0-2 were written before the interruption
+    assert not any(path.endswith(('init.mp4', 'seg0.m4s', 'seg2.m4s')) for path in server.request_paths)
+    assert not (tmp_path / 'video.mp4.fragments').exists()
@@ -0,0 +1,68 @@
+"""Parity of the single-pass link extractor with the BeautifulSoup one"""
+import os
+
+import pytest
+
+pytest.importorskip('bs4')
+
+import main
+from baseline_extract import extract_links_from_html as baseline_extract
+
+BASE_URL = 'https://www.aparat.com/playlist/1'
+
+PARITY_CASES = [
+    '<a href="/v/abc">x</a><a href="https://www.aparat.com/v/def?x=1&amp;y=2">',
+    "<A HREF='/v/Q1'>x</A><a href=/v/unq>y</a><a data-x='>' href=\"/v/gt\">",
+    '<!-- <a href="/v/commented"> --><a href="/v/after">',
+    '<script>var s="<a href=\'/v/inscript\'>"; x="/v/js_id-1";</script><a href="/v/real">',
+    '<script src="x.js"></script><script></script><SCRIPT>"/v/UP"</SCRIPT>',
+    '<style>a[href="/v/css"]{}</style><iframe src="https://www.aparat.com/v/ifr?s=1"></iframe>'
+    '<iframe src="//www.aparat.com/v/rel"></iframe>',
+    '<a href="/v/dup" href="/v/dup2"><a href><a href=""><abbr href="/v/no"><a-b href="/v/x">',
+    '<a href="/v/ent&#47;x">&amp;</a><a\nhref="/v/nl"\n>',
+    '<iframe src="/v/relonly">',
+    '<a href="https://example.com/v/other">',
+    # Unclosed raw-text elements swallow the rest of the page
+    '<script>"/v/e1"',
+    '<script>"/v/e1" <a href="/v/a1">',
+    '<a href="/v/a0"><script>"/v/s1"</script><script>"/v/e1"',
+    '<script>"/v/e1"</scr',
+    '<a href="/v/a0"><style>x <a href="/v/a1">',
+    '<a href="/v/x"><a href="/v/y"',
+    '<script>"/v/s1"</ SCRIPT ><a href="/v/a1">',
+    # Self-closing script/style tags have no content
+    '<script src="a.js"/><a href="/v/a1">',
+    '<svg><style/></svg><a href="/v/a1">',
+    '<script async/>"/v/s1"</script><a href="/v/a1">',
+    # ... unless the slash belongs to an unquoted value
+    '<script src=a.js/><a href="/v/a1">',
+    '<script a= /><a href="/v/a1">',
+    # An unclosed comment ends at the next '>'
+    '<!-- <a href="/v/c1">',
+    '<!-- x <a href="/v/c1"> <a href="/v/c2">',
+    '<!-- <script>"/v/s1" <a href="/v/a1">',
+    '<!--x--!><a href="/v/a1">',
+    '<!--><a href="/v/a1">',
+    '<!-- a -- ><a href="/v/c1"> --><a href="/v/a1">',
+    # Declarations, marked sections and processing instructions
+    '<!x <a href="/v/d1"><a href="/v/a1">',
+    '<![CDATA[<a href="/v/d1">]]><a href="/v/a1">',
+    '<![CDATA[ x <a href="/v/d1"><a href="/v/a1">',
+    '<![if x]><a href="/v/a1"><![endif]><a href="/v/a2">',
+    '<?php <a href="/v/d1"> ?><a href="/v/a1">',
+    '</ <a href="/v/d1"><a href="/v/a1">',
+]
+
+
+@pytest.mark.parametrize('html_content', PARITY_CASES)
+def test_parity_with_baseline(html_content):
+    assert list(main.iter_links_from_html(html_content, BASE_URL)) == baseline_extract(html_content, BASE_URL)
+
+
+def test_parity_on_large_fixture():
+    fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'playlist_large.html')
+    with open(fixture, encoding='utf-8') as f:
+        html_content = f.read()
+    links = list(main.iter_links_from_html(html_content, BASE_URL))
+    assert links == baseline_extract(html_content, BASE_URL)
+    assert len(links) > 1000
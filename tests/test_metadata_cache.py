@@ -0,0 +1,51 @@
+"""Metadata cache hits carry enough of the info dict to download without extracting"""
+import main
+
+
+def use_cache(tmp_path, monkeypatch):
+    cache = main.MetadataCache(str(tmp_path / 'metadata.sqlite3'))
+    monkeypatch.setattr(main, 'metadata_cache', cache)
+    monkeypatch.setattr(main.post_processor, 'steps', [])
+    monkeypatch.setitem(main.run_counters, 'extractor_calls', 0)
+    return cache
+
+
+def download(video_url, tmp_path, formats_info):
+    stats = {'downloaded': 0, 'failed': 0, 'total_size_mb': 0}
+    selected_format = next(fmt for fmt in formats_info['formats'] if fmt['format_id'] == '720p')
+    result = main.download_video_with_format(video_url, selected_format, str(tmp_path), 1, 1, stats,
+                                             formats_info['info'])
+    return result, stats
+
+
+def test_cache_hit_downloads_without_extraction(fake_server, tmp_path, monkeypatch):
+    server = fake_server()
+    use_cache(tmp_path, monkeypatch)
+    video_url = f"{server.base_url}/v/bench0000"
+    main.get_video_formats(video_url, verbose=False, use_cache=True)     # Miss: extracts and caches
+    server.request_paths.clear()
+    
+    formats_info = main.get_video_formats(video_url, verbose=False, use_cache=True)
+    assert formats_info['info']['__from_cache']
+    result, stats = download(video_url, tmp_path, formats_info)
+    
+    assert result is True and stats['downloaded'] == 1
+    assert main.run_counters['extractor_calls'] == 1
+    assert '/v/bench0000' not in server.request_paths
+
+
+def test_expired_cached_url_extracts_again(fake_server, tmp_path, monkeypatch):
+    server = fake_server()
+    cache = use_cache(tmp_path, monkeypatch)
+    video_url = f"{server.base_url}/v/bench0000"
+    main.get_video_formats(video_url, verbose=False, use_cache=True)
+    # The cached media URL now answers 403, like an expired signed URL
+    server.faults['/media/bench0000_720.mp4'] = ['forbidden']
+    
+    formats_info = main.get_video_formats(video_url, verbose=False, use_cache=True)
+    result, stats = download(video_url, tmp_path, formats_info)
+    
+    assert result is True
+    assert stats['downloaded'] == 1 and stats['failed'] == 0
+    assert main.run_counters['extractor_calls'] == 2
+    assert cache.get('bench0000') is None
@@ -0,0 +1,56 @@
+"""Playlist enumeration through the paginated JSON API and the page fallback"""
+import main
+
+API_PATH = '/api/fa/v1/video/playlist/one/playlist_id/1'
+
+
+def video_links(server):
+    return [f"{server.base_url}/v/{video_id}" for video_id in server.video_ids]
+
+
+def test_api_pagination(fake_server):
+    server = fake_server(videos=5, api_page_size=2)
+    links = list(main.iter_playlist_videos(f"{server.base_url}/playlist/1"))
+    
+    assert links == video_links(server)
+    assert server.request_paths.count(API_PATH) == 3
+    assert '/playlist/1' not in server.request_paths
+
+
+def test_crawl_playlists_api_pagination(fake_server):
+    server = fake_server(videos=5, api_page_size=2)
+    playlist_url = f"{server.base_url}/playlist/1"
+    
+    assert list(main.crawl_playlists([playlist_url])) == [(playlist_url, video_links(server))]
+    assert server.request_paths.count(API_PATH) == 3
+
+
+def test_api_pagination_stops_at_a_repeated_page(fake_server, monkeypatch):
+    server = fake_server(videos=5, api_page_size=2)
+    api_page = server.api_page
+    # Page 2 links back to page 1
+    monkeypatch.setattr(server, 'api_page', lambda page: api_page(page).replace(b'?page=3', b'?page=1'))
+    links = list(main.iter_playlist_videos(f"{server.base_url}/playlist/1"))
+    
+    assert links == video_links(server)[:4]
+    assert server.request_paths.count(API_PATH) == 3    # First page, ?page=2, ?page=1
+
+
+def test_fallback_to_page_without_api(fake_server):
+    server = fake_server(videos=5, api=False)
+    links = list(main.iter_playlist_videos(f"{server.base_url}/playlist/1"))
+    
+    assert links == video_links(server)
+    assert server.request_paths.count(API_PATH) == 1     # 404 is not retried
+    assert '/playlist/1' in server.request_paths
+
+
+def test_fallback_after_api_fails_mid_pagination(fake_server, monkeypatch):
+    server = fake_server(videos=5, api_page_size=2)
+    monkeypatch.setattr(main.retry_controller, 'max_attempts', 2)
+    # First page works, then every attempt at the second page fails
+    server.faults[API_PATH] = [None, 'error', 'error']
+    links = list(main.iter_playlist_videos(f"{server.base_url}/playlist/1"))
+    
+    assert links == video_links(server)
+    assert '/playlist/1' in server.request_paths
@@ -0,0 +1,31 @@
+"""CPU-bound post-processing stays out of the download slot"""
+import yt_dlp
+
+import main
+
+
+def test_ytdlp_download_leaves_fixups_to_the_pool(fake_server, tmp_path, monkeypatch):
+    server = fake_server()
+    monkeypatch.setattr(main, 'SEGMENTED_DOWNLOADS', False)     # Transfer through yt-dlp
+    options = []
+    init = yt_dlp.YoutubeDL.__init__
+    
+    def recording_init(self, params=None, *args, **kwargs):
+        options.append(dict(params or {}))
+        init(self, params, *args, **kwargs)
+    
+    monkeypatch.setattr(yt_dlp.YoutubeDL, '__init__', recording_init)
+    submitted = []
+    monkeypatch.setattr(main.post_processor, 'submit', lambda filepath, *args: submitted.append(filepath))
+    
+    video_url = f"{server.base_url}/v/bench0000"
+    formats_info = main.get_video_formats(video_url, verbose=False, use_cache=False)
+    selected_format = next(fmt for fmt in formats_info['formats'] if fmt['format_id'] == '720p')
+    stats = {'downloaded': 0, 'failed': 0, 'total_size_mb': 0}
+    assert main.download_video_with_format(video_url, selected_format, str(tmp_path), 1, 1, stats,
+                                           formats_info['info'])
+    
+    download_options = options[-1]
+    assert download_options['fixup'] == 'never'
+    assert download_options['postprocessors'] == []
+    assert submitted and submitted[0].startswith(str(tmp_path))
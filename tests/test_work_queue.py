@@ -0,0 +1,39 @@
+"""WorkQueue lease handling: a worker that lost its lease cannot record a result"""
+import main
+
+
+def make_queue(tmp_path, **kwargs):
+    work_queue = main.WorkQueue(str(tmp_path / 'queue.db'), **kwargs)
+    work_queue.enqueue('https://example.com/playlist/1', ['https://example.com/v/a'], str(tmp_path), {})
+    return work_queue
+
+
+def job_state(work_queue, job_id):
+    return work_queue._connect().execute("SELECT state, worker FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+
+def test_finish_by_lease_holder(tmp_path):
+    work_queue = make_queue(tmp_path)
+    job = work_queue.lease('a')
+    assert work_queue.finish(job['id'], 'a', 'done')
+    assert tuple(job_state(work_queue, job['id'])) == ('done', None)
+
+
+def test_finish_after_takeover_is_ignored(tmp_path):
+    work_queue = make_queue(tmp_path, lease_seconds=-1)
+    job = work_queue.lease('a')
+    # The lease has already run out, so the next lease hands the job to b
+    assert work_queue.lease('b')['id'] == job['id']
+    for state in ('done', 'skipped'):
+        assert not work_queue.finish(job['id'], 'a', state)
+    assert not work_queue.finish(job['id'], 'a', 'failed', 'error')
+    assert not work_queue.finish(job['id'], 'a', 'failed', 'error', retry=False)
+    assert tuple(job_state(work_queue, job['id'])) == ('leased', 'b')
+
+
+def test_finish_after_requeue_is_ignored(tmp_path):
+    work_queue = make_queue(tmp_path, lease_seconds=-1)
+    job = work_queue.lease('a')
+    work_queue.requeue_expired()
+    assert not work_queue.finish(job['id'], 'a', 'done')
+    assert tuple(job_state(work_queue, job['id'])) == ('queued', None)